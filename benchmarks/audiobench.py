@@ -0,0 +1,112 @@
+"""Event loop latency while many servers start songs at once
+
+Compares the old blocking wait on the Downloader's threading.Event with
+awaiting its future, with youtube-dl replaced by a fixed delay.
+Needs the bot's requirements installed, run it from the bot's folder:
+
+    python -m benchmarks.audiobench
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+import __main__
+
+SERVERS = 20
+EXTRACT_DELAY = 0.3
+TICK = 0.01
+
+
+class FakeServer:
+    def __init__(self, sid):
+        self.id = sid
+
+
+class FakeBot:
+    def __init__(self, loop):
+        self.loop = loop
+
+
+async def measure_lag(stop):
+    """Largest lateness of a TICK sleep until stop is set"""
+    worst = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        worst = max(worst, time.perf_counter() - start - TICK)
+    return worst
+
+
+async def run(loop, audio, blocking):
+    stop = asyncio.Event(loop=loop)
+    lag = loop.create_task(measure_lag(stop))
+    await asyncio.sleep(0.05)
+    servers = [FakeServer(str(i)) for i in range(SERVERS)]
+    # Different songs, so the pool can't share extractions
+    urls = ["https://youtube.com/watch?v={}".format(s.id) for s in servers]
+    if blocking:
+        async def start(server, url):
+            d = audio.downloaders[server.id] = audio.extractor.submit(
+                url, owner=server.id)
+            d.done.wait()
+    else:
+        start = audio._guarantee_downloaded
+    began = time.perf_counter()
+    await asyncio.gather(*[start(s, u) for s, u in zip(servers, urls)],
+                         loop=loop)
+    elapsed = time.perf_counter() - began
+    stop.set()
+    worst = await lag
+    audio.downloaders.clear()
+    return elapsed, worst
+
+
+def main():
+    # What red.py provides to cogs when it loads them
+    __main__.send_cmd_help = None
+    __main__.settings = None
+    from cogs import audio
+
+    def get_info(self):
+        time.sleep(EXTRACT_DELAY)
+        self.song = audio.Song(id=self.url.rsplit("=", 1)[1],
+                               title=self.url, webpage_url=self.url,
+                               duration=60)
+
+    audio.Downloader.get_info = get_info
+    audio.Downloader.download = lambda self: time.sleep(EXTRACT_DELAY)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # Only what _guarantee_downloaded uses, Audio.__init__ would read
+    # the bot's data folder
+    cog = audio.Audio.__new__(audio.Audio)
+    cog.bot = FakeBot(loop)
+    cog.settings = {"MAX_LENGTH": 0, "EXTRACT_TIMEOUT": 60}
+    cog.downloaders = {}
+    cog.cache_path = tempfile.mkdtemp()
+    for i in range(SERVERS):  # Cache hits, only metadata is resolved
+        open(os.path.join(cog.cache_path, str(i)), "w").close()
+    cog.files = audio.AudioFileCache(cog.cache_path)
+
+    print("{} servers, {}s per extraction".format(SERVERS, EXTRACT_DELAY))
+    for workers in (4, SERVERS):
+        for blocking in (True, False):
+            # No metadata cache, every run has to extract
+            cog.extractor = audio.ExtractionPool(loop, workers,
+                                                 files=cog.files)
+            elapsed, worst = loop.run_until_complete(
+                run(loop, cog, blocking))
+            cog.extractor.shutdown()
+            print("{:>2} workers, {:<8}: all started in {:5.2f}s, worst loop "
+                  "lag {:6.1f}ms".format(workers,
+                                         "blocking" if blocking else "awaited",
+                                         elapsed, worst * 1000))
+    loop.close()
+    shutil.rmtree(cog.cache_path)
+
+
+if __name__ == "__main__":
+    main()
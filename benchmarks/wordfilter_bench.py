@@ -0,0 +1,42 @@
+"""Per message cost of the word filter for growing filter lists
+
+Compares the old per-word substring test with the compiled filter.
+Run it from the bot's folder:
+
+    python -m benchmarks.wordfilter_bench
+"""
+import random
+import string
+import timeit
+
+from cogs.utils.wordfilter import compile_filter
+
+
+def random_word(shortest, longest):
+    return "".join(random.choice(string.ascii_lowercase)
+                   for i in range(random.randint(shortest, longest)))
+
+
+def naive(words, message):
+    content = message.lower()
+    for w in words:
+        if w in content:
+            return w
+
+
+def main():
+    random.seed(26)
+    message = " ".join(random_word(2, 9) for i in range(60))
+    for size in (10, 1000, 10000):
+        words = [random_word(5, 12) for i in range(size)]
+        matcher = compile_filter(words)
+        runs = 200
+        old = timeit.timeit(lambda: naive(words, message), number=runs)
+        new = timeit.timeit(lambda: matcher.search(message.lower()),
+                            number=runs)
+        print("{:>6} words: substring {:8.1f}us/msg, compiled {:8.1f}us/msg"
+              "".format(size, old / runs * 1e6, new / runs * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,7 @@ from discord.ext import commands
 from .utils.chat_formatting import box
 from .utils.dataIO import dataIO
 from .utils import checks
-from __main__ import user_allowed, send_cmd_help
-from copy import deepcopy
+from __main__ import user_allowed, send_cmd_help, MessageView
 import os
 import discord
 
@@ -13,6 +12,7 @@ class Alias:
         self.bot = bot
         self.file_path = "data/alias/aliases.json"
         self.aliases = dataIO.load_json(self.file_path)
+        self._tries = {}
         self.remove_old()
 
     @commands.group(pass_context=True, no_pm=True)
@@ -45,6 +45,7 @@ class Alias:
             self.aliases[server.id] = {}
         if command not in self.bot.commands:
             self.aliases[server.id][command] = to_execute
+            self._tries.pop(server.id, None)
             dataIO.save_json(self.file_path, self.aliases)
             await self.bot.say("Alias '{}' added.".format(command))
         else:
@@ -63,8 +64,7 @@ class Alias:
                 new_content += "help "
                 new_content += help_cmd[len(self.get_prefix(server,
                                         help_cmd)):]
-                message = ctx.message
-                message.content = new_content
+                message = MessageView(ctx.message, new_content)
                 await self.bot.process_commands(message)
             else:
                 await self.bot.say("That alias doesn't exist.")
@@ -88,6 +88,7 @@ class Alias:
         server = ctx.message.server
         if server.id in self.aliases:
             self.aliases[server.id].pop(command, None)
+            self._tries.pop(server.id, None)
             dataIO.save_json(self.file_path, self.aliases)
         await self.bot.say("Alias '{}' deleted.".format(command))
 
@@ -110,26 +111,45 @@ class Alias:
             else:
                 await self.bot.say("There are no aliases on this server.")
 
-    async def on_message(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
+    async def check_alias(self, parsed):
+        message = parsed.message
+        if len(message.content) < 2:
             return
 
         msg = message.content
         server = message.server
-        prefix = self.get_prefix(server, msg)
+        prefix = parsed.prefix
 
-        if not prefix:
-            return
-
-        if server.id in self.aliases and user_allowed(message):
-            alias = self.first_word(msg[len(prefix):]).lower()
-            if alias in self.aliases[server.id]:
+        if server.id in self.aliases:
+            alias = self.match_alias(server, msg, len(prefix))
+            if alias is not None and user_allowed(message):
                 new_command = self.aliases[server.id][alias]
                 args = message.content[len(prefix + alias):]
-                new_message = deepcopy(message)
-                new_message.content = prefix + new_command + args
+                new_message = MessageView(message, prefix + new_command + args)
                 await self.bot.process_commands(new_message)
 
+    def match_alias(self, server, msg, start):
+        """Returns the alias msg's first word after start is, if any
+
+        Walks the server's alias trie one character at a time, so only
+        as much of the message as the longest alias is ever looked at."""
+        trie = self._tries.get(server.id)
+        if trie is None:
+            trie = self._tries[server.id] = {}
+            for alias in self.aliases[server.id]:
+                node = trie
+                for char in alias:
+                    node = node.setdefault(char, {})
+                node[None] = alias
+        node = trie
+        for char in msg[start:]:
+            if char == " ":
+                break
+            node = node.get(char.lower())
+            if node is None:
+                return None
+        return node.get(None)
+
     def part_of_existing_command(self, alias, server):
         '''Command or alias'''
         for command in self.bot.commands:
@@ -157,6 +177,7 @@ class Alias:
                 del self.aliases[sid][alias]
             for alias, command in to_add:  # For fixing caps
                 self.aliases[sid][alias] = command
+        self._tries.clear()
         dataIO.save_json(self.file_path, self.aliases)
 
     def first_word(self, msg):
@@ -188,4 +209,6 @@ def check_file():
 def setup(bot):
     check_folder()
     check_file()
-    bot.add_cog(Alias(bot))
+    n = Alias(bot)
+    bot.add_message_listener(n.check_alias, own=True, commands=True)
+    bot.add_cog(n)
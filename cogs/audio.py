@@ -19,6 +19,7 @@ import time
 import inspect
 import subprocess
 from .utils.chat_formatting import pagify
+from concurrent.futures import ThreadPoolExecutor
 import random
 
 __author__ = "tekulvw"
@@ -244,27 +245,41 @@ class Playlist:
             return None
 
 
-class Downloader(threading.Thread):
+class Downloader:
+    """A youtube-dl info extraction, optionally followed by a download
+
+    Runs on the ExtractionPool's threads, future resolves when done."""
+
     def __init__(self, url, max_duration=None, download=False,
-                 cache_path="data/audio/cache", *args, **kwargs):
-        super().__init__(*args, **kwargs)
+                 cache_path="data/audio/cache", song=None):
         self.url = url
         self.max_duration = max_duration
         self.done = threading.Event()
-        self.song = None
+        self.song = song
         self.failed = False
+        self.future = None
+        self.status = "queued"
         self._download = download
         self.hit_max_length = threading.Event()
         self._yt = None
 
+    def is_alive(self):
+        return self.future is not None and not self.future.done()
+
     def run(self):
         try:
-            self.get_info()
+            self.status = "extracting"
+            if self.song is None:
+                self.get_info()
             if self._download:
+                self.status = "downloading"
                 self.download()
+            self.status = "done"
         except MaximumLength:
+            self.status = "too long"
             self.hit_max_length.set()
         except:
+            self.status = "failed"
             self.failed = True
         self.done.set()
 
@@ -272,6 +287,8 @@ class Downloader(threading.Thread):
         self.duration_check()
 
         if not os.path.isfile('data/audio/cache' + self.song.id):
+            if self._yt is None:
+                self._yt = youtube_dl.YoutubeDL(youtube_dl_options)
             video = self._yt.extract_info(self.url)
             self.song = Song(**video)
 
@@ -301,6 +318,229 @@ class Downloader(threading.Thread):
         self.song = Song(**video)
 
 
+class SongInfoCache:
+    """Title, duration, id and webpage_url of the songs youtube-dl
+    resolved, kept in data/audio/metadata.json
+
+    Songs are looked up by the URL they were resolved from or, for
+    YouTube, by video id. Entries expire ttl seconds after they were
+    resolved and the least recently used ones go past max_entries."""
+
+    FIELDS = ("id", "title", "duration", "webpage_url")
+    YT_ID = re.compile(r'(?:youtube\.com/.*[?&]v=|youtu\.be/)([\w-]{11})')
+
+    def __init__(self, path, ttl=604800, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        data = dataIO.load_json(path)
+        songs = sorted(data["SONGS"].items(),
+                       key=lambda s: s[1]["LAST_USED"])
+        data["SONGS"] = collections.OrderedDict(songs)
+        self.data = dataIO.register(path, data)
+        self.songs = data["SONGS"]
+        self.urls = data["URLS"]
+
+    def get(self, url):
+        """Returns a Song for url, or None if it isn't cached"""
+        sid = self.urls.get(url)
+        if sid is None:
+            match = self.YT_ID.search(url)
+            if match is None:
+                return None
+            sid = match.group(1)
+        entry = self.songs.get(sid)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry["CACHED_AT"] > self.ttl:
+            self._remove(sid)
+            dataIO.mark_dirty(self.path)
+            return None
+        # Not worth a write on its own, saved with the next change
+        entry["LAST_USED"] = now
+        self.songs.move_to_end(sid)
+        return Song(**{k: entry[k] for k in self.FIELDS if k in entry})
+
+    def put(self, url, song):
+        if getattr(song, "id", None) is None or hasattr(song, "entries"):
+            return  # Playlists aren't songs
+        now = time.time()
+        entry = {k: getattr(song, k) for k in self.FIELDS}
+        entry["CACHED_AT"] = entry["LAST_USED"] = now
+        old = self.songs.pop(song.id, None)
+        entry["URLS"] = old["URLS"] if old is not None else []
+        for u in (url, song.webpage_url):
+            if u and u not in entry["URLS"]:
+                entry["URLS"].append(u)
+                self.urls[u] = song.id
+        self.songs[song.id] = entry
+        while len(self.songs) > self.max_entries:
+            self._remove(next(iter(self.songs)))
+        dataIO.mark_dirty(self.path)
+
+    def _remove(self, sid):
+        entry = self.songs.pop(sid)
+        for u in entry["URLS"]:
+            if self.urls.get(u) == sid:
+                del self.urls[u]
+
+
+class AudioFileCache:
+    """Index of the files in the audio cache folder
+
+    Sizes are read once, when a file is scanned at startup or added
+    after a download, so the cache size is a running total instead of
+    a directory walk. Files are ordered by last use, evict() drops the
+    least recently used ones first."""
+
+    def __init__(self, path):
+        self.path = path
+        self.files = collections.OrderedDict()  # name: [size, last use]
+        self.size = 0
+        self.rescan()
+
+    def rescan(self):
+        entries = []
+        for name in os.listdir(self.path):
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((max(stat.st_atime, stat.st_mtime), name,
+                            stat.st_size))
+        self.files.clear()
+        self.size = 0
+        for last_use, name, size in sorted(entries):
+            self.files[name] = [size, last_use]
+            self.size += size
+
+    def __contains__(self, name):
+        return name in self.files
+
+    def add(self, name):
+        try:
+            size = os.path.getsize(os.path.join(self.path, name))
+        except OSError:
+            return
+        if name in self.files:
+            self.size -= self.files.pop(name)[0]
+        self.files[name] = [size, time.time()]
+        self.size += size
+
+    def touch(self, name):
+        if name not in self.files:
+            return self.add(name)
+        self.files[name][1] = time.time()
+        self.files.move_to_end(name)
+
+    def remove(self, name):
+        entry = self.files.pop(name, None)
+        if entry is None:
+            return 0
+        self.size -= entry[0]
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # In use, keep counting it
+            self.files[name] = entry
+            self.files.move_to_end(name, last=False)
+            self.size += entry[0]
+            return 0
+        return entry[0]
+
+    def evict(self, budget, protected=()):
+        """Removes least recently used files until the cache fits in
+        budget bytes, never touching protected ones. Returns the bytes
+        freed."""
+        freed = 0
+        for name in list(self.files):
+            if self.size <= budget:
+                break
+            if name not in protected:
+                freed += self.remove(name)
+        return freed
+
+
+class ExtractionPool:
+    """Runs Downloaders on a bounded number of threads
+
+    Asking for a URL that's already being extracted returns the running
+    Downloader instead of starting another one. Downloaders can belong
+    to owners (server IDs), cancel() drops an owner's claim on them and
+    cancels the ones nobody else is waiting for. Those that haven't
+    started never run, those already running finish in their thread
+    but their result is dropped, and asking for their URL again starts
+    a new Downloader.
+
+    Info only requests for songs in the metadata cache are answered
+    right away, and resolved songs are added to it."""
+
+    def __init__(self, loop, workers=4, metadata=None, files=None):
+        self.loop = loop
+        self.metadata = metadata
+        self.files = files
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._running = {}  # (url, download): Downloader
+        self._owners = {}  # (url, download): set of owners
+        self._owned = collections.defaultdict(set)  # owner: keys
+
+    def submit(self, url, max_duration=None, download=False, owner=None):
+        key = (url, download)
+        cached = None
+        if self.metadata is not None:
+            cached = self.metadata.get(url)
+        if cached is not None and not download:
+            d = Downloader(url, max_duration, song=cached)
+            d.status = "done"
+            d.done.set()
+            d.future = asyncio.Future(loop=self.loop)
+            d.future.set_result(None)
+            return d
+        d = self._running.get(key)
+        if d is None:
+            d = Downloader(url, max_duration, download=download, song=cached)
+            d.future = self.loop.run_in_executor(self.executor, d.run)
+            d.future.add_done_callback(lambda f: self._finished(key, d))
+            self._running[key] = d
+            self._owners[key] = set()
+        if owner is not None:
+            self._owners[key].add(owner)
+            self._owned[owner].add(key)
+        return d
+
+    def cancel(self, owner):
+        for key in self._owned.pop(owner, ()):
+            owners = self._owners.get(key)
+            if owners is None:
+                continue
+            owners.discard(owner)
+            if not owners:
+                log.debug("cancelling extraction of {}".format(key[0]))
+                del self._owners[key]
+                self._running.pop(key).future.cancel()
+
+    def shutdown(self):
+        for d in list(self._running.values()):
+            d.future.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _finished(self, key, d):
+        if self.metadata is not None and d.song is not None and \
+                not d.future.cancelled() and "[SEARCH:]" not in key[0]:
+            self.metadata.put(key[0], d.song)
+        if self.files is not None and key[1] and d.song is not None:
+            self.files.add(d.song.id)
+        if self._running.get(key) is d:
+            del self._running[key]
+            for owner in self._owners.pop(key, ()):
+                self._owned[owner].discard(key)
+                if not self._owned[owner]:
+                    del self._owned[owner]
+
+
 class Audio:
     """Music Streaming."""
 
@@ -309,9 +549,16 @@ class Audio:
         self.queue = {}  # add deque's, repeat
         self.downloaders = {}  # sid: object
         self.settings = dataIO.load_json("data/audio/settings.json")
+        self.metadata = SongInfoCache("data/audio/metadata.json",
+                                      self.settings["METADATA_TTL"],
+                                      self.settings["METADATA_MAX"])
+        self.cache_path = "data/audio/cache"
+        self.files = AudioFileCache(self.cache_path)
+        self.extractor = ExtractionPool(bot.loop,
+                                        self.settings["EXTRACT_WORKERS"],
+                                        self.metadata, self.files)
         self.server_specific_setting_keys = ["VOLUME", "VOTE_ENABLED",
                                              "VOTE_THRESHOLD", "NOPPL_DISCONNECT"]
-        self.cache_path = "data/audio/cache"
         self.local_playlist_path = "data/audio/localtracks"
         self._old_game = False
 
@@ -319,12 +566,23 @@ class Audio:
 
         self.connect_timers = {}
 
+        # Per server player tasks and the events that wake them up:
+        #   a song finished or was skipped, something got queued
+        self.players = {}
+        self.player_events = {}
+
         if player == "ffmpeg":
             self.settings["AVCONV"] = False
         elif player == "avconv":
             self.settings["AVCONV"] = True
         self.save_settings()
 
+    def __unload(self):
+        for task in self.players.values():
+            task.cancel()
+        self.extractor.shutdown()
+        dataIO.unregister(self.metadata.path)
+
     async def _add_song_status(self, song):
         if self._old_game is False:
             self._old_game = list(self.bot.servers)[0].me.game
@@ -337,26 +595,28 @@ class Audio:
         if server.id not in self.queue:
             self._setup_queue(server)
         self.queue[server.id]["QUEUE"].append(url)
+        self._wake_player(server.id)
 
     def _add_to_temp_queue(self, server, url):
         if server.id not in self.queue:
             self._setup_queue(server)
         self.queue[server.id]["TEMP_QUEUE"].append(url)
+        self._wake_player(server.id)
 
     def _addleft_to_queue(self, server, url):
         if server.id not in self.queue:
             self._setup_queue()
         self.queue[server.id]["QUEUE"].appendleft(url)
+        self._wake_player(server.id)
 
     def _cache_desired_files(self):
-        filelist = []
+        filelist = set()
         for server in self.downloaders:
             song = self.downloaders[server].song
             try:
-                filelist.append(song.id)
+                filelist.add(song.id)
             except AttributeError:
                 pass
-        shuffle(filelist)
         return filelist
 
     def _cache_max(self):
@@ -368,21 +628,17 @@ class Audio:
         return max([60, 48 * math.log(x) * x**0.3])  # log is not log10
 
     def _cache_required_files(self):
-        queue = copy.deepcopy(self.queue)
-        filelist = []
-        for server in queue:
-            now_playing = queue[server].get("NOW_PLAYING")
+        filelist = set()
+        for server in list(self.queue):
+            now_playing = self.queue[server].get("NOW_PLAYING")
             try:
-                filelist.append(now_playing.id)
+                filelist.add(now_playing.id)
             except AttributeError:
                 pass
         return filelist
 
     def _cache_size(self):
-        songs = os.listdir(self.cache_path)
-        size = sum(map(lambda s: os.path.getsize(
-            os.path.join(self.cache_path, s)) / 10**6, songs))
-        return size
+        return self.files.size / 10**6
 
     def _cache_too_large(self):
         if self._cache_size() > self._cache_max():
@@ -392,6 +648,7 @@ class Audio:
     def _clear_queue(self, server):
         if server.id not in self.queue:
             return
+        self._stop_downloader(server)
         self.queue[server.id]["QUEUE"] = deque()
         self.queue[server.id]["TEMP_QUEUE"] = deque()
 
@@ -439,8 +696,12 @@ class Audio:
 
         log.debug("making player on sid {}".format(server.id))
 
+        def finished():  # Called from the player's thread
+            self.bot.loop.call_soon_threadsafe(self._wake_player, server.id)
+
         voice_client.audio_player = voice_client.create_ffmpeg_player(
-            song_filename, use_avconv=use_avconv, options=options)
+            song_filename, use_avconv=use_avconv, options=options,
+            after=finished)
 
         # Set initial volume
         vol = self.get_server_settings(server)['VOLUME'] / 100
@@ -476,14 +737,8 @@ class Audio:
         """
         Doesn't actually download, just get's info for uses like queue_list
         """
-        downloaders = []
-        for url in url_list:
-            d = Downloader(url)
-            d.start()
-            downloaders.append(d)
-
-        while any([d.is_alive() for d in downloaders]):
-            await asyncio.sleep(0.1)
+        downloaders = [self.extractor.submit(url) for url in url_list]
+        await self._wait_downloaders(downloaders)
 
         songs = [d.song for d in downloaders if d.song is not None]
         return songs
@@ -499,8 +754,9 @@ class Audio:
 
         max_length = self.settings["MAX_LENGTH"]
 
-        while next_dl.is_alive():
-            await asyncio.sleep(0.5)
+        await self._wait_downloaders([next_dl])
+        if next_dl.song is None:
+            return
 
         if curr_dl.song.id != next_dl.song.id:
             log.debug("downloader ID's mismatch on sid {}".format(server.id) +
@@ -510,40 +766,23 @@ class Audio:
                 next_dl.duration_check()
             except MaximumLength:
                 return
-            self.downloaders[server.id] = Downloader(next_dl.url, max_length,
-                                                     download=True)
-            self.downloaders[server.id].start()
-
-    def _dump_cache(self, ignore_desired=False):
-        reqd = self._cache_required_files()
-        log.debug("required cache files:\n\t{}".format(reqd))
-
-        opt = self._cache_desired_files()
-        log.debug("desired cache files:\n\t{}".format(opt))
-
-        prev_size = self._cache_size()
-
-        for file in os.listdir(self.cache_path):
-            if file not in reqd:
-                if ignore_desired or file not in opt:
-                    try:
-                        os.remove(os.path.join(self.cache_path, file))
-                    except OSError:
-                        # A directory got in the cache?
-                        pass
-                    except WindowsError:
-                        # Removing a file in use, reqd failed
-                        pass
-
-        post_size = self._cache_size()
-        dumped = prev_size - post_size
-
-        if not ignore_desired and self._cache_too_large():
-            log.debug("must dump desired files")
-            return dumped + self._dump_cache(ignore_desired=True)
-
+            self.downloaders[server.id] = self.extractor.submit(
+                next_dl.url, max_length, download=True, owner=server.id)
+
+    def _cache_protected_files(self):
+        """Now playing and prefetched songs, which must stay cached"""
+        protected = self._cache_required_files()
+        protected |= self._cache_desired_files()
+        log.debug("protected cache files:\n\t{}".format(protected))
+        return protected
+
+    def _dump_cache(self, budget=0):
+        """Evicts least recently used songs down to budget MB
+
+        Returns how many MB were dumped."""
+        dumped = self.files.evict(budget * 10**6,
+                                  self._cache_protected_files()) / 10**6
         log.debug("dumped {} MB of audio files".format(dumped))
-
         return dumped
 
     # TODO: _enable_controls()
@@ -606,25 +845,26 @@ class Audio:
         if server.id not in self.downloaders:  # We don't have a downloader
             log.debug("sid {} not in downloaders, making one".format(
                 server.id))
-            self.downloaders[server.id] = Downloader(url, max_length)
+            self.downloaders[server.id] = self.extractor.submit(
+                url, max_length, owner=server.id)
 
         if self.downloaders[server.id].url != url:  # Our downloader is old
-            # I'm praying to Jeezus that we don't accidentally lose a running
-            #   Downloader
+            # The pool keeps running one for this url if there is one
             log.debug("sid {} in downloaders but wrong url".format(server.id))
-            self.downloaders[server.id] = Downloader(url, max_length)
-
-        try:
-            # We're assuming we have the right thing in our downloader object
-            self.downloaders[server.id].start()
-            log.debug("starting our downloader for sid {}".format(server.id))
-        except RuntimeError:
-            # Queue manager already started it for us, isn't that nice?
-            pass
-
-        # Getting info w/o download
-        self.downloaders[server.id].done.wait()
-
+            self.downloaders[server.id] = self.extractor.submit(
+                url, max_length, owner=server.id)
+
+        # Getting info w/o download, the loop keeps running meanwhile
+        timeout = self.settings["EXTRACT_TIMEOUT"]
+        if not await self._wait_downloaders([self.downloaders[server.id]],
+                                            timeout=timeout):
+            log.warning("getting the info of {} for sid {} took over {}s"
+                        "".format(url, server.id, timeout))
+            self._stop_downloader(server)
+            raise InvalidSong("Timed out getting the info of {}".format(url))
+
+        if self.downloaders[server.id].song is None:
+            raise InvalidSong("Could not get the info of {}".format(url))
         # This will throw a maxlength exception if required
         self.downloaders[server.id].duration_check()
         song = self.downloaders[server.id].song
@@ -635,16 +875,18 @@ class Audio:
         cache_location = os.path.join(self.cache_path, song.id)
         if not os.path.exists(cache_location):
             log.debug("cache miss on song id {}".format(song.id))
-            self.downloaders[server.id] = Downloader(url, max_length,
-                                                     download=True)
-            self.downloaders[server.id].start()
-
-            while self.downloaders[server.id].is_alive():
-                await asyncio.sleep(0.5)
-
-            song = self.downloaders[server.id].song
+            d = self.downloaders[server.id] = self.extractor.submit(
+                url, max_length, download=True, owner=server.id)
+            await self._wait_downloaders([d])
+
+            if d.hit_max_length.is_set():
+                raise MaximumLength("songid {} is too long".format(song.id))
+            if d.song is None:
+                raise InvalidSong("Could not download {}".format(url))
+            song = d.song
         else:
             log.debug("cache hit on song id {}".format(song.id))
+            self.files.touch(song.id)
 
         return song
 
@@ -781,11 +1023,8 @@ class Audio:
 
     async def _parse_sc_playlist(self, url):
         playlist = []
-        d = Downloader(url)
-        d.start()
-
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        d = self.extractor.submit(url)
+        await self._wait_downloaders([d])
 
         for entry in d.song.entries:
             if entry["url"][4] != "s":
@@ -797,12 +1036,10 @@ class Audio:
         return playlist
 
     async def _parse_yt_playlist(self, url):
-        d = Downloader(url)
-        d.start()
+        d = self.extractor.submit(url)
         playlist = []
 
-        while d.is_alive():
-            await asyncio.sleep(0.5)
+        await self._wait_downloaders([d])
 
         for entry in d.song.entries:
             try:
@@ -886,8 +1123,7 @@ class Audio:
 
     def _player_count(self):
         count = 0
-        queue = copy.deepcopy(self.queue)
-        for sid in queue:
+        for sid in list(self.queue):
             server = self.bot.get_server(sid)
             try:
                 vc = self.voice_client(server)
@@ -964,6 +1200,7 @@ class Audio:
         else:
             self._setup_queue(server)
         self.queue[server.id]["QUEUE"].extend(songlist)
+        self._wake_player(server.id)
 
     def _set_queue_channel(self, server, channel):
         if server.id not in self.queue:
@@ -1011,6 +1248,7 @@ class Audio:
         await self._disconnect_voice_client(server)
 
     def _stop_downloader(self, server):
+        self.extractor.cancel(server.id)
         if server.id not in self.downloaders:
             return
 
@@ -1043,6 +1281,17 @@ class Audio:
             else:
                 await self._remove_song_status()
 
+    async def _wait_downloaders(self, downloaders, timeout=None):
+        """Waits for Downloaders to finish or be cancelled
+
+        Returns False if timeout ran out first."""
+        futures = [d.future for d in downloaders]
+        if not futures:
+            return True
+        done, pending = await asyncio.wait(futures, timeout=timeout,
+                                           loop=self.bot.loop)
+        return not pending
+
     def _valid_playlist_name(self, name):
         for char in name:
             if char.isdigit() or char.isalpha() or char == "_":
@@ -1202,6 +1451,20 @@ class Audio:
         await self.bot.say("Currently playing music in {} servers.".format(
             count))
 
+    @audiostat.command(name="downloads")
+    async def audiostat_downloads(self):
+        """What each server's downloader is doing."""
+        lines = []
+        for sid, d in self.downloaders.items():
+            server = self.bot.get_server(sid)
+            name = server.name if server is not None else sid
+            lines.append("{}: {} {}".format(name, d.status, d.url))
+        if not lines:
+            await self.bot.say("Nothing is being downloaded.")
+            return
+        for page in pagify("\n".join(lines), ["\n"]):
+            await self.bot.say(page)
+
     @commands.group(pass_context=True)
     async def cache(self, ctx):
         """Cache management tools."""
@@ -1312,7 +1575,8 @@ class Audio:
         #   downloading the next song
 
         if self.currently_downloading(server):
-            await self.bot.say("I'm already downloading a file!")
+            await self.bot.say("I'm already downloading a file! ({})".format(
+                self.downloaders[server.id].status))
             return
 
         lists = self._list_local_playlists()
@@ -2158,7 +2422,7 @@ class Audio:
                 # Our cache is too big, dumping
                 log.debug("cache too large ({} > {}), dumping".format(
                     self._cache_size(), self._cache_max()))
-                self._dump_cache()
+                self._dump_cache(self._cache_max())
             await asyncio.sleep(5)  # No need to run this every half second
 
     async def cache_scheduler(self):
@@ -2302,14 +2566,14 @@ class Audio:
                 log.debug("calling _play because temp_queue is non-empty")
                 try:
                     song = await self._play(sid, temp_queue.popleft())
-                except MaximumLength:
+                except (MaximumLength, InvalidSong):
                     return
             elif len(queue) > 0:  # We're in the normal queue
                 url = queue.popleft()
                 log.debug("calling _play on the normal queue")
                 try:
                     song = await self._play(sid, url)
-                except MaximumLength:
+                except (MaximumLength, InvalidSong):
                     return
                 if repeat and last_song:
                     queue.append(last_song.webpage_url)
@@ -2323,35 +2587,67 @@ class Audio:
             # We're playing but we might be able to download a new song
             curr_dl = self.downloaders.get(server.id)
             if len(temp_queue) > 0:
-                next_dl = Downloader(temp_queue.peekleft(),
-                                     max_length)
+                next_dl = self.extractor.submit(temp_queue.peekleft(),
+                                                max_length, owner=server.id)
             elif len(queue) > 0:
-                next_dl = Downloader(queue.peekleft(), max_length)
+                next_dl = self.extractor.submit(queue.peekleft(), max_length,
+                                                owner=server.id)
             else:
                 next_dl = None
 
             if next_dl is not None:
                 # Download next song
-                next_dl.start()
                 await self._download_next(server, curr_dl, next_dl)
 
-    async def queue_scheduler(self):
-        while self == self.bot.get_cog('Audio'):
-            tasks = []
-            queue = copy.deepcopy(self.queue)
-            for sid in queue:
-                if len(queue[sid]["QUEUE"]) == 0 and \
-                        len(queue[sid]["TEMP_QUEUE"]) == 0:
-                    continue
-                # log.debug("scheduler found a non-empty queue"
-                #           " for sid: {}".format(sid))
-                tasks.append(
-                    self.bot.loop.create_task(self.queue_manager(sid)))
-            completed = [t.done() for t in tasks]
-            while not all(completed):
-                completed = [t.done() for t in tasks]
-                await asyncio.sleep(0.5)
-            await asyncio.sleep(1)
+    def _wake_player(self, sid):
+        """Wakes up a server's player, starting one if it has none"""
+        if self != self.bot.get_cog('Audio'):
+            return
+        if sid not in self.player_events:
+            self.player_events[sid] = asyncio.Event(loop=self.bot.loop)
+        self.player_events[sid].set()
+        if sid not in self.players:
+            self.players[sid] = self.bot.loop.create_task(self.player(sid))
+
+    async def player(self, sid):
+        """Plays a server's queue, sleeping until a song ends, gets
+        skipped or something is queued. Exits once there's nothing
+        playing and nothing queued, so idle servers cost nothing."""
+        event = self.player_events[sid]
+        try:
+            while self == self.bot.get_cog('Audio') and sid in self.queue:
+                event.clear()
+                server = self.bot.get_server(sid)
+                if server is None:  # We left it
+                    break
+                queue = self.queue[sid]
+                was_playing = self.is_playing(server)
+                if queue["QUEUE"] or queue["TEMP_QUEUE"]:
+                    try:
+                        await self.queue_manager(sid)
+                    except Exception:
+                        log.exception("queue manager failed on sid {}, "
+                                      "retrying in 5s".format(sid))
+                        await self._wait_player_event(event, 5)
+                        continue
+                    if not was_playing:
+                        # Started a song, or skipped one that couldn't
+                        # play: go again to prefetch or try the next one
+                        continue
+                elif not was_playing:
+                    break
+                await event.wait()
+        finally:
+            if self.players.get(sid) is asyncio.Task.current_task(
+                    loop=self.bot.loop):
+                del self.players[sid]
+
+    async def _wait_player_event(self, event, timeout):
+        try:
+            await asyncio.wait_for(event.wait(), timeout,
+                                   loop=self.bot.loop)
+        except asyncio.TimeoutError:
+            pass
 
     async def reload_monitor(self):
         while self == self.bot.get_cog('Audio'):
@@ -2425,6 +2721,8 @@ def check_files():
     default = {"VOLUME": 50, "MAX_LENGTH": 3700, "VOTE_ENABLED": True,
                "MAX_CACHE": 0, "SOUNDCLOUD_CLIENT_ID": None,
                "TITLE_STATUS": True, "AVCONV": False, "VOTE_THRESHOLD": 50,
+               "EXTRACT_WORKERS": 4, "EXTRACT_TIMEOUT": 60,
+               "METADATA_TTL": 604800, "METADATA_MAX": 5000,
                "SERVERS": {}}
     settings_path = "data/audio/settings.json"
 
@@ -2447,6 +2745,11 @@ def check_files():
                         "Adding " + str(key) + " field to audio settings.json")
             dataIO.save_json(settings_path, current)
 
+    metadata_path = "data/audio/metadata.json"
+    if not dataIO.is_valid_json(metadata_path):
+        print("Creating empty audio metadata.json...")
+        dataIO.save_json(metadata_path, {"SONGS": {}, "URLS": {}})
+
 def verify_ffmpeg_avconv():
     try:
         subprocess.call(["ffmpeg", "-version"], stdout=subprocess.DEVNULL)
@@ -2493,7 +2796,6 @@ def setup(bot):
     n = Audio(bot, player=player)  # Praise 26
     bot.add_cog(n)
     bot.add_listener(n.voice_state_update, 'on_voice_state_update')
-    bot.loop.create_task(n.queue_scheduler())
     bot.loop.create_task(n.disconnect_timer())
     bot.loop.create_task(n.reload_monitor())
     bot.loop.create_task(n.cache_scheduler())
@@ -132,17 +132,12 @@ class Bias:
         await self.bot.send_message(channel, helpMessage)
 
 
-    async def check_message(self, message):
+    async def check_message(self, parsed):
+        message = parsed.message
         channel = message.channel
         author = message.author
         server = message.server
 
-        if message.server is None:
-            return
-
-        if author == self.bot.user:
-            return
-
         #if not self.bot.user_allowed(message):
         #    return
 
@@ -152,10 +147,7 @@ class Bias:
         if message.channel.id not in self.settings[server.id]["CHANNELS"]:
             return
 
-        if message.author is self.bot.user:
-            return
-
-        if self._is_command(message.content):
+        if parsed.is_command:
             await asyncio.sleep(10)
             await self.bot.delete_message(message)
             return
@@ -295,12 +287,6 @@ class Bias:
         role = discord.utils.find(lambda r: r.name.lower() == rolename.lower(), roles)
         return role
 
-    def _is_command(self, msg):
-        for p in self.bot.settings.prefixes:
-            if msg.startswith(p):
-                return True
-        return False
-
     # source: http://stackoverflow.com/a/32640407/1443726
     def _num_to_words(self, num):
         d = { 0 : 'zero', 1 : 'one', 2 : 'two', 3 : 'three', 4 : 'four', 5 : 'five',
@@ -375,5 +361,6 @@ def setup(bot):
     check_folders()
     check_files()
     n = Bias(bot)
-    bot.add_listener(n.check_message, "on_message")
+    channels = [c for s in n.settings.values() for c in s["CHANNELS"]]
+    bot.add_message_listener(n.check_message, channels=channels)
     bot.add_cog(n)
@@ -6,6 +6,29 @@ import os
 import re
 from .utils.chat_formatting import pagify
 
+PARAMETER = re.compile("\{([^}]+)\}")
+
+
+class CommandTemplate:
+    """A custom command's text split once into literal and parameter
+    segments, so rendering it is a single join"""
+
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text):
+        self.text = text
+        # Literals at even indexes, parameter names at odd ones
+        self.parts = PARAMETER.split(text)
+
+    def render(self, message, transform):
+        if len(self.parts) == 1:
+            return self.text
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = transform(parts[i], message)
+        return "".join(parts)
+
+
 class CustomCommands:
     """Custom commands."""
 
@@ -13,6 +36,9 @@ class CustomCommands:
         self.bot = bot
         self.file_path = "data/customcom/commands.json"
         self.c_commands = dataIO.load_json(self.file_path)
+        self.templates = {}
+        for sid in self.c_commands:
+            self.compile_server(sid)
 
     @commands.group(pass_context=True, no_pm=True, name="commands")
     async def _commands(self, ctx):
@@ -145,6 +171,7 @@ class CustomCommands:
         if command not in cmdlist:
             cmdlist[command] = text
             self.c_commands[server.id] = cmdlist
+            self.compile_server(server.id)
             dataIO.save_json(self.file_path, self.c_commands)
             await self.bot.say("Custom command successfully added.")
         else:
@@ -165,6 +192,7 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist[command] = text
                 self.c_commands[server.id] = cmdlist
+                self.compile_server(server.id)
                 dataIO.save_json(self.file_path, self.c_commands)
                 await self.bot.say("Custom command successfully edited.")
             else:
@@ -186,6 +214,7 @@ class CustomCommands:
             if command in cmdlist:
                 cmdlist.pop(command, None)
                 self.c_commands[server.id] = cmdlist
+                self.compile_server(server.id)
                 dataIO.save_json(self.file_path, self.c_commands)
                 await self.bot.say("Custom command successfully deleted.")
             else:
@@ -219,40 +248,36 @@ class CustomCommands:
         else:
             await self.bot.say("There are no custom commands in this server. Use addcom [command] [text]")
 
-    async def checkCC(self, message):
-        if len(message.content) < 2 or message.channel.is_private:
+    async def checkCC(self, parsed):
+        message = parsed.message
+        if len(message.content) < 2:
             return
 
         server = message.server
-        prefix = self.get_prefix(message)
+        prefix = parsed.prefix
 
-        if not prefix:
+        templates = self.templates.get(server.id)
+        if not templates:
             return
+        template = templates.get(message.content[len(prefix):].lower())
+        if template is not None and user_allowed(message):
+            cmd = template.render(message, self.transform_parameter)
+            await self.bot.send_message(message.channel, cmd)
 
-        if server.id in self.c_commands and user_allowed(message):
-            cmdlist = self.c_commands[server.id]
-            cmd = message.content[len(prefix):]
-            if cmd in cmdlist.keys():
-                cmd = cmdlist[cmd]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
-            elif cmd.lower() in cmdlist.keys():
-                cmd = cmdlist[cmd.lower()]
-                cmd = self.format_cc(cmd, message)
-                await self.bot.send_message(message.channel, cmd)
-
-    def get_prefix(self, message):
-        for p in self.bot.settings.get_prefixes(message.server):
-            if message.content.startswith(p):
-                return p
-        return False
+    def compile_server(self, sid):
+        """Rebuilds the case-folded template index of a server
+
+        Lowercase names win over older mixed-case duplicates, as those
+        are what addcom and editcom write."""
+        cmdlist = self.c_commands.get(sid, {})
+        templates = {}
+        for name in sorted(cmdlist, key=lambda n: n == n.lower()):
+            templates[name.lower()] = CommandTemplate(cmdlist[name])
+        self.templates[sid] = templates
 
     def format_cc(self, command, message):
-        results = re.findall("\{([^}]+)\}", command)
-        for result in results:
-            param = self.transform_parameter(result, message)
-            command = command.replace("{" + result + "}", param)
-        return command
+        return CommandTemplate(command).render(message,
+                                               self.transform_parameter)
 
     def transform_parameter(self, result, message):
         """
@@ -294,5 +319,5 @@ def setup(bot):
     check_folders()
     check_files()
     n = CustomCommands(bot)
-    bot.add_listener(n.checkCC, "on_message")
+    bot.add_message_listener(n.checkCC, own=True, commands=True)
     bot.add_cog(n)
@@ -3,7 +3,6 @@ from discord.ext import commands
 from cogs.utils.dataIO import dataIO
 from collections import namedtuple, defaultdict, deque
 from datetime import datetime
-from copy import deepcopy
 from .utils import checks
 from cogs.utils.chat_formatting import pagify, box
 from enum import Enum
@@ -113,25 +112,26 @@ SLOT_PAYOUTS_MSG = ("Slot machine payouts:\n"
 class Bank:
 
     def __init__(self, bot, file_path):
-        self.accounts = dataIO.load_json(file_path)
+        self.file_path = file_path
+        # Accounts are read and written one at a time, kept in SQLite
+        # each of them is its own row
+        dataIO.open_store(file_path, row_depth=2)
         self.bot = bot
 
     def create_account(self, user, *, initial_balance=0):
         server = user.server
         if not self.account_exists(user):
-            if server.id not in self.accounts:
-                self.accounts[server.id] = {}
-            if user.id in self.accounts:  # Legacy account
-                balance = self.accounts[user.id]["balance"]
-            else:
+            try:  # Legacy account
+                balance = dataIO.store_get(self.file_path,
+                                           [user.id])["balance"]
+            except KeyError:
                 balance = initial_balance
             timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
             account = {"name": user.name,
                        "balance": balance,
                        "created_at": timestamp
                        }
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
+            self._save_account(server, user, account)
             return self.get_account(user)
         else:
             raise AccountAlreadyExists()
@@ -152,8 +152,7 @@ class Bank:
         account = self._get_account(user)
         if account["balance"] >= amount:
             account["balance"] -= amount
-            self.accounts[server.id][user.id] = account
-            self._save_bank()
+            self._save_account(server, user, account)
         else:
             raise InsufficientBalance()
 
@@ -163,8 +162,7 @@ class Bank:
             raise NegativeValue()
         account = self._get_account(user)
         account["balance"] += amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._save_account(server, user, account)
 
     def set_credits(self, user, amount):
         server = user.server
@@ -172,8 +170,7 @@ class Bank:
             raise NegativeValue()
         account = self._get_account(user)
         account["balance"] = amount
-        self.accounts[server.id][user.id] = account
-        self._save_bank()
+        self._save_account(server, user, account)
 
     def transfer_credits(self, sender, receiver, amount):
         if amount < 0:
@@ -197,36 +194,28 @@ class Bank:
             return False
 
     def wipe_bank(self, server):
-        self.accounts[server.id] = {}
-        self._save_bank()
+        dataIO.store_put(self.file_path, [server.id], {})
 
     def get_server_accounts(self, server):
-        if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-            return accounts
-        else:
+        try:
+            raw_server_accounts = dataIO.store_get(self.file_path,
+                                                   [server.id])
+        except KeyError:
             return []
+        accounts = []
+        for k, v in raw_server_accounts.items():
+            v["id"] = k
+            v["server"] = server
+            acc = self._create_account_obj(v)
+            accounts.append(acc)
+        return accounts
 
     def get_all_accounts(self):
+        # Servers that have since been left will be ignored
+        # Same for users_id from the old bank format
         accounts = []
-        for server_id, v in self.accounts.items():
-            server = self.bot.get_server(server_id)
-            if server is None:
-                # Servers that have since been left will be ignored
-                # Same for users_id from the old bank format
-                continue
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+        for server in self.bot.servers:
+            accounts.extend(self.get_server_accounts(server))
         return accounts
 
     def get_balance(self, user):
@@ -247,13 +236,14 @@ class Bank:
                              "created_at server member")
         return Account(**account)
 
-    def _save_bank(self):
-        dataIO.save_json("data/economy/bank.json", self.accounts)
+    def _save_account(self, server, user, account):
+        # Writes just this account instead of rewriting the whole bank
+        dataIO.store_put(self.file_path, [server.id, user.id], account)
 
     def _get_account(self, user):
         server = user.server
         try:
-            return deepcopy(self.accounts[server.id][user.id])
+            return dataIO.store_get(self.file_path, [server.id, user.id])
         except KeyError:
             raise NoAccount()
 
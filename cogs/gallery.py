@@ -4,9 +4,6 @@ from .utils.dataIO import dataIO
 import os
 from __main__ import send_cmd_help
 from .utils import checks
-import re
-import aiohttp
-import json
 
 __author__ = "Sebastian Winkler"
 __version__ = "1.0.0"
@@ -19,6 +16,10 @@ class Gallery:
         self.galleries_file_path = "data/gallery/galleries.json"
         self.galleries = dataIO.load_json(self.galleries_file_path)
 
+    def source_channels(self):
+        return [g["sourceChannelId"] for galleries in self.galleries.values()
+                for g in galleries]
+
     @commands.group(pass_context=True, no_pm=True, name="gallery")
     @checks.mod_or_permissions(administrator=True)
     async def _gallery(self, ctx):
@@ -40,6 +41,7 @@ class Gallery:
         self.galleries[server.id].append(galleryData)
 
         dataIO.save_json(self.galleries_file_path, self.galleries)
+        self.bot.route_message_listener(self.check_link, channels=self.source_channels())
 
         await self.bot.say("{0} Added gallery, from {1.mention} to {2.mention}! :ok_hand:".format(author.mention, source, target))
 
@@ -86,46 +88,22 @@ class Gallery:
             return
 
         dataIO.save_json(self.galleries_file_path, self.galleries)
+        self.bot.route_message_listener(self.check_link, channels=self.source_channels())
 
         await self.bot.say("{0} Successfully deleted gallery `#{1}` from this server! :ok_hand:".format(author.mention, galleryId))
 
-    async def check_link(self, message):
+    async def check_link(self, parsed):
+        message = parsed.message
         server = message.server
         author = message.author
         channel = message.channel
 
-        if message.server is None:
-            return
-
-        if message.channel.is_private:
-            return
-
-        if author == self.bot.user:
-            return
-
-        if self._is_command(message.content):
-            return
-
         if server.id not in self.galleries:
             return
 
         for galleryData in self.galleries[server.id]:
             if galleryData["sourceChannelId"] == channel.id:
-                links = []
-                if len(message.attachments) > 0:
-                    for attachment in message.attachments:
-                        links.append(attachment["url"])
-                if len(message.content) > 0:
-                    if "http" in message.content:
-                        for item in message.content.split(" "):
-                            linksFound = re.findall("(?P<url><?https?://[^\s]+>?)", item)
-                            if linksFound != None:
-                                for linkFound in linksFound:
-                                    if not (linkFound[0] == "<" and linkFound[len(linkFound)-1] == ">"):
-                                        if linkFound[0] == "<":
-                                            links.append(linkFound[1:len(linkFound)])
-                                        else:
-                                            links.append(linkFound)
+                links = parsed.urls
                 if len(links) > 0:
                     sourceChannel = server.get_channel(galleryData["sourceChannelId"])
                     targetChannel = server.get_channel(galleryData["targetChannelId"])
@@ -138,22 +116,10 @@ class Gallery:
             return await self.bot.send_message(target, linkMessage)
         else:
             linkMessage = "posted {0}".format(link, author, source, target)
-            url = "https://discordapp.com/api/webhooks/{0[WEBHOOK_ID]}/{0[WEBHOOK_TOKEN]}".format(galleryData)
-            headers = {"user-agent": "Red-cog-Gallery/"+__version__, "content-type": "application/json"}
             payload = {"username": author.name, "avatar_url": author.avatar_url, "content": linkMessage}
-            conn = aiohttp.TCPConnector(verify_ssl=False)
-            session = aiohttp.ClientSession(connector=conn)
-            async with session.post(url, data=json.dumps(payload), headers=headers) as r:
-                await r.text()
-            session.close()
+            await self.bot.webhooks.execute(galleryData["WEBHOOK_ID"], galleryData["WEBHOOK_TOKEN"], payload, user_agent="Red-cog-Gallery/"+__version__)
             return True
 
-    def _is_command(self, msg):
-        for p in self.bot.settings.prefixes:
-            if msg.startswith(p):
-                return True
-        return False
-
 def check_folder():
     if not os.path.exists("data/gallery"):
         print("Creating data/gallery folder...")
@@ -171,6 +137,7 @@ def setup(bot):
     check_folder()
     check_file()
     n = Gallery(bot)
-    bot.add_listener(n.check_link, "on_message")
+    bot.add_message_listener(n.check_link, commands=False,
+                             channels=n.source_channels())
     bot.add_cog(n)
 
@@ -363,10 +363,11 @@ class General:
                 return poll
         return False
 
-    async def check_poll_votes(self, message):
-        if message.author.id != self.bot.user.id:
-            if self.getPollByChannel(message):
-                    self.getPollByChannel(message).checkAnswer(message)
+    async def check_poll_votes(self, parsed):
+        message = parsed.message
+        poll = self.getPollByChannel(message)
+        if poll:
+            poll.checkAnswer(message)
 
     def fetch_joined_at(self, user, server):
         """Just a special case for someone special :^)"""
@@ -464,5 +465,5 @@ class NewPoll():
 
 def setup(bot):
     n = General(bot)
-    bot.add_listener(n.check_poll_votes, "on_message")
+    bot.add_message_listener(n.check_poll_votes, private=True)
     bot.add_cog(n)
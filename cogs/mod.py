@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands
 from .utils.dataIO import dataIO
 from .utils import checks
+from .utils.wordfilter import compile_filter
 from __main__ import send_cmd_help, settings
 from datetime import datetime
 from collections import deque, defaultdict
@@ -10,10 +11,8 @@ import os
 import re
 import logging
 import asyncio
-import aiohttp
 import json
 import base64
-from aiohttp.helpers import FormData
 import time
 
 
@@ -70,17 +69,20 @@ class Mod:
         self.blacklist_list = dataIO.load_json("data/mod/blacklist.json")
         self.ignore_list = dataIO.load_json("data/mod/ignorelist.json")
         self.filter = dataIO.load_json("data/mod/filter.json")
-        self.past_names = dataIO.load_json("data/mod/past_names.json")
-        self.past_nicknames = dataIO.load_json("data/mod/past_nicknames.json")
+        self._filter_matchers = {}
+        self.past_names = dataIO.load_journaled("data/mod/past_names.json")
+        self.past_nicknames = dataIO.load_journaled("data/mod/past_nicknames.json")
         settings = dataIO.load_json("data/mod/settings.json")
         self.settings = defaultdict(lambda: default_settings.copy(), settings)
         self.cache = defaultdict(lambda: deque(maxlen=3))
-        self.cases = dataIO.load_json("data/mod/modlog.json")
+        self.cases = dataIO.load_journaled("data/mod/modlog.json",
+                                           row_depth=2)
         self.last_case = defaultdict(dict)
         self._tmp_banned_cache = []
         perms_cache = dataIO.load_json("data/mod/perms_cache.json")
         self._perms_cache = defaultdict(dict, perms_cache)
-        self.slowmode_channels = []
+        self.slowmode = dataIO.register("data/mod/slowmode.json",
+            dataIO.load_json("data/mod/slowmode.json"))
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -177,8 +179,7 @@ class Mod:
     async def resetcases(self, ctx):
         """Resets modlog's cases"""
         server = ctx.message.server
-        self.cases[server.id] = {}
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        dataIO.journal_set("data/mod/modlog.json", [server.id], {})
         await self.bot.say("Cases have been reset.")
 
     @modset.command(pass_context=True, no_pm=True)
@@ -1129,6 +1130,7 @@ class Mod:
                 self.filter[server.id].append(w.lower())
                 added += 1
         if added:
+            self._filter_matchers.pop(server.id, None)
             dataIO.save_json("data/mod/filter.json", self.filter)
             await self.bot.say("Words added to filter.")
         else:
@@ -1155,6 +1157,7 @@ class Mod:
                 self.filter[server.id].remove(w.lower())
                 removed += 1
         if removed:
+            self._filter_matchers.pop(server.id, None)
             dataIO.save_json("data/mod/filter.json", self.filter)
             await self.bot.say("Words removed from filter.")
         else:
@@ -1276,66 +1279,52 @@ class Mod:
         # create webhook
         url = "https://discordapp.com/api/channels/{0.id}/webhooks".format(new_channel)
         payload = {"name": "robyul/mod: move message webhook"}
-        conn = aiohttp.TCPConnector(verify_ssl=False)
-        session = aiohttp.ClientSession(connector=conn)
+        session = self.bot.webhooks.session
         async with session.post(url, data=json.dumps(payload), headers=headers) as r:
             resultWebhookObject = await r.json()
         if "token" in resultWebhookObject and "id" in resultWebhookObject:
             # use webhook
-            new_message_text = ""
-            new_media_attachements = []
-            last_author = None
-            i = 1
-            for old_message in old_messages:
-                if old_message.content != "":
-                    new_message_text += old_message.content + "\n"
-                if len(old_message.attachments) > 0:
-                    for attachment in old_message.attachments:
-                        new_media_attachements.append(attachment)
-                last_author = old_message.author
-                if len(old_messages) <= i or old_messages[i].author != last_author:
-                    url = "https://discordapp.com/api/webhooks/{0[id]}/{0[token]}".format(resultWebhookObject)
-                    new_message_prefix = "_Message moved from {0.mention} to {1.mention} by {2.name}_\n".format(source_channel, new_channel, mover)
-                    if new_message_text != "":
-                        await asyncio.sleep(2)
-                        new_message_text = new_message_prefix + new_message_text
-                        payload = {"username": last_author.name, "avatar_url": last_author.avatar_url, "content": new_message_text}
-                        async with session.post(url, data=json.dumps(payload), headers=headers) as r:
-                            result = await r.text()
-                        if result != "":
-                            print(result)
-                        new_message_text = ""
-                    if len(new_media_attachements) > 0:
-                        await asyncio.sleep(2)
-                        for attachment in new_media_attachements:
-                            async with await session.get(attachment["url"]) as resp:
-                                payload = FormData()
-                                payload.add_field("file",
-                                               await resp.read(),
-                                               filename=attachment["filename"])
-                                payload.add_field("username", last_author.name)
-                                payload.add_field("avatar_url", last_author.avatar_url)
-                                payload.add_field("content", new_message_prefix)
-                                async with session.post(url, data=payload, headers=headers) as r:
-                                    result = await r.text()
-                                #if result != "":
-                                #   print(result)
-                        new_media_attachements = []
-                i += 1
-
-            # delete webhook
-            await asyncio.sleep(2)
-            url = "https://discordapp.com/api/webhooks/{0[id]}/{0[token]}".format(resultWebhookObject)
-            payload = {}
-            async with session.delete(url, data=json.dumps(payload), headers=headers) as r:
-                await r.text()
-                #result = await r.json()
-            #print(result)
+            try:
+                new_message_text = ""
+                new_media_attachements = []
+                last_author = None
+                i = 1
+                for old_message in old_messages:
+                    if old_message.content != "":
+                        new_message_text += old_message.content + "\n"
+                    if len(old_message.attachments) > 0:
+                        for attachment in old_message.attachments:
+                            new_media_attachements.append(attachment)
+                    last_author = old_message.author
+                    if len(old_messages) <= i or old_messages[i].author != last_author:
+                        new_message_prefix = "_Message moved from {0.mention} to {1.mention} by {2.name}_\n".format(source_channel, new_channel, mover)
+                        if new_message_text != "":
+                            new_message_text = new_message_prefix + new_message_text
+                            payload = {"username": last_author.name, "avatar_url": last_author.avatar_url, "content": new_message_text}
+                            result = await self.bot.webhooks.execute(resultWebhookObject["id"], resultWebhookObject["token"], payload, user_agent="Red-cog-Mod/1")
+                            if result != "":
+                                print(result)
+                            new_message_text = ""
+                        if len(new_media_attachements) > 0:
+                            for attachment in new_media_attachements:
+                                async with session.get(attachment["url"]) as resp:
+                                    file = (attachment["filename"], await resp.read())
+                                payload = {"username": last_author.name, "avatar_url": last_author.avatar_url, "content": new_message_prefix}
+                                await self.bot.webhooks.execute(resultWebhookObject["id"], resultWebhookObject["token"], payload, file=file, user_agent="Red-cog-Mod/1")
+                            new_media_attachements = []
+                    i += 1
+            finally:
+                # delete webhook
+                await asyncio.sleep(2)
+                url = "https://discordapp.com/api/webhooks/{0[id]}/{0[token]}".format(resultWebhookObject)
+                payload = {}
+                async with session.delete(url, data=json.dumps(payload), headers=headers) as r:
+                    await r.text()
+                    #result = await r.json()
+                #print(result)
         else:
             print("error creating webhook:", resultWebhookObject, ", payload:", json.dumps(payload))
 
-        session.close()
-
     @commands.command(pass_context=True, no_pm=True, name="userlist")
     @checks.mod_or_permissions(administrator=True)
     async def _userlist(self, ctx):
@@ -1379,17 +1368,15 @@ class Mod:
             raise TypeError('Only messages, members or roles may be passed')
 
         server = obj.server
-        admin_role = settings.get_server_admin(server)
+        admin_ids = settings.get_server_role_ids(server, exact=True)["ADMIN"]
 
         if isinstance(obj, discord.Role):
-            return obj.name == admin_role
+            return obj.id in admin_ids
 
         if user.id == settings.owner:
             return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
         else:
-            return False
+            return not admin_ids.isdisjoint(r.id for r in user.roles)
 
     def is_mod_or_superior(self, obj):
         if isinstance(obj, discord.Message):
@@ -1402,33 +1389,22 @@ class Mod:
             raise TypeError('Only messages, members or roles may be passed')
 
         server = obj.server
-        admin_role = settings.get_server_admin(server)
-        mod_role = settings.get_server_mod(server)
-        submod_role = settings.get_server_submod(server)
+        role_ids = settings.get_server_role_ids(server, exact=True)
 
         if isinstance(obj, discord.Role):
-            return obj.name in [admin_role, mod_role]
+            return obj.id in role_ids["ADMIN"] or obj.id in role_ids["MOD"]
 
         if user.id == settings.owner:
             return True
-        elif discord.utils.get(user.roles, name=admin_role):
-            return True
-        elif discord.utils.get(user.roles, name=mod_role):
-            return True
-        elif discord.utils.get(user.roles, name=submod_role):
-            return True
         else:
-            return False
+            return not role_ids["ANY"].isdisjoint(r.id for r in user.roles)
 
     async def new_case(self, server, *, action, mod=None, user, reason=None, until=None, channel=None):
         mod_channel = server.get_channel(self.settings[server.id]["mod-log"])
         if mod_channel is None:
             return
 
-        if server.id not in self.cases:
-            self.cases[server.id] = {}
-
-        case_n = len(self.cases[server.id]) + 1
+        case_n = len(self.cases.get(server.id, {})) + 1
 
         case = {
             "case"         : case_n,
@@ -1455,21 +1431,20 @@ class Mod:
         except:
             pass
 
-        self.cases[server.id][str(case_n)] = case
+        dataIO.journal_set("data/mod/modlog.json",
+                           [server.id, str(case_n)], case)
 
         if mod:
             self.last_case[server.id][mod.id] = case_n
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
-
     async def update_case(self, server, *, case, mod=None, reason=None,
                           until=False):
         channel = server.get_channel(self.settings[server.id]["mod-log"])
         if channel is None:
             raise NoModLogChannel()
 
-        case = str(case)
-        case = self.cases[server.id][case]
+        case_n = str(case)
+        case = self.cases[server.id][case_n]
 
         if case["moderator_id"] is not None:
             if case["moderator_id"] != mod.id:
@@ -1491,7 +1466,8 @@ class Mod:
 
         case_msg = self.format_case_msg(case)
 
-        dataIO.save_json("data/mod/modlog.json", self.cases)
+        dataIO.journal_set("data/mod/modlog.json",
+                           [server.id, case_n], case)
 
         msg = await self.bot.get_message(channel, case["message"])
         if msg:
@@ -1546,19 +1522,27 @@ class Mod:
 
         return case_msg
 
+    def _filter_matcher(self, server):
+        """Compiled filter of the server, rebuilt after add/remove"""
+        if server.id not in self._filter_matchers:
+            words = self.filter.get(server.id)
+            self._filter_matchers[server.id] = compile_filter(words)
+        return self._filter_matchers[server.id]
+
     async def check_filter(self, message):
         server = message.server
-        if server.id in self.filter.keys():
-            for w in self.filter[server.id]:
-                if w in message.content.lower():
-                    try:
-                        await self.bot.delete_message(message)
-                        logger.info("Message deleted in server {}."
-                                    "Filtered: {}"
-                                    "".format(server.id, w))
-                        return True
-                    except:
-                        pass
+        matcher = self._filter_matcher(server)
+        if matcher is not None:
+            match = matcher.search(message.content.lower())
+            if match is not None:
+                try:
+                    await self.bot.delete_message(message)
+                    logger.info("Message deleted in server {}."
+                                "Filtered: {}"
+                                "".format(server.id, match.group(0)))
+                    return True
+                except:
+                    pass
         return False
 
     async def check_duplicates(self, message):
@@ -1636,9 +1620,9 @@ class Mod:
         await asyncio.sleep(delay)
         await _delete_helper(self.bot, message)
 
-    async def on_message(self, message):
-        if message.channel.is_private or self.bot.user == message.author \
-         or not isinstance(message.author, discord.Member):
+    async def check_message(self, parsed):
+        message = parsed.message
+        if not isinstance(message.author, discord.Member):
             return
         elif self.is_mod_or_superior(message):
             return
@@ -1660,28 +1644,26 @@ class Mod:
     async def check_names(self, before, after):
         if before.name != after.name:
             if before.id not in self.past_names:
-                self.past_names[before.id] = [after.name]
+                dataIO.journal_set("data/mod/past_names.json",
+                                   [before.id], [after.name])
             else:
                 if after.name not in self.past_names[before.id]:
                     names = deque(self.past_names[before.id], maxlen=20)
                     names.append(after.name)
-                    self.past_names[before.id] = list(names)
-            dataIO.save_json("data/mod/past_names.json", self.past_names)
+                    dataIO.journal_set("data/mod/past_names.json",
+                                       [before.id], list(names))
 
         if before.nick != after.nick and after.nick is not None:
             server = before.server
-            if server.id not in self.past_nicknames:
-                self.past_nicknames[server.id] = {}
-            if before.id in self.past_nicknames[server.id]:
-                nicks = deque(self.past_nicknames[server.id][before.id],
-                              maxlen=20)
+            server_nicks = self.past_nicknames.get(server.id, {})
+            if before.id in server_nicks:
+                nicks = deque(server_nicks[before.id], maxlen=20)
             else:
                 nicks = []
             if after.nick not in nicks:
                 nicks.append(after.nick)
-                self.past_nicknames[server.id][before.id] = list(nicks)
-                dataIO.save_json("data/mod/past_nicknames.json",
-                                 self.past_nicknames)
+                dataIO.journal_set("data/mod/past_nicknames.json",
+                                   [server.id, before.id], list(nicks))
 
     def are_overwrites_empty(self, overwrites):
         """There is currently no cleaner way to check if a
@@ -1709,30 +1691,38 @@ class Mod:
         if author == self.bot.user:
             return
 
-        should_delete_message = False
-        for slowmode_channel in self.slowmode_channels:
-            if "channel_id" in slowmode_channel and slowmode_channel["channel_id"] != "" \
-            and "interval" in slowmode_channel and slowmode_channel["interval"] != "" \
-            and "slowmode_users" in slowmode_channel:
-                if slowmode_channel["channel_id"] == channel.id:
-                    # channel is in slowmode
-                    add_user_to_slowmode_list = True
-                    timestamp_now = int(time.time())
-
-                    for slowmode_user in slowmode_channel["slowmode_users"]:
-                        if "user_id" in slowmode_user and slowmode_user["user_id"] != "" and slowmode_user["user_id"] == author.id:
-                            add_user_to_slowmode_list = False
-                            if "last_message_timestamp" in slowmode_user and slowmode_user["last_message_timestamp"] != "":
-                                if (int(slowmode_user["last_message_timestamp"]) + int(slowmode_channel["interval"])) > timestamp_now:
-                                    # Delete message
-                                    should_delete_message = True
-                                elif append == True:
-                                    slowmode_user["last_message_timestamp"] = timestamp_now
-
-                    if append == True:
-                        if add_user_to_slowmode_list == True:
-                            slowmode_channel["slowmode_users"].append({"user_id": author.id, "last_message_timestamp": timestamp_now})
-        return should_delete_message
+        slowmode_channel = self.slowmode.get(channel.id)
+        if slowmode_channel is None:
+            return False
+
+        timestamp_now = int(time.time())
+        users = slowmode_channel["users"]
+        last_message_timestamp = users.get(author.id)
+        if last_message_timestamp is not None and \
+                last_message_timestamp + slowmode_channel["interval"] > timestamp_now:
+            return True
+        if append == True:
+            users[author.id] = timestamp_now
+            dataIO.mark_dirty("data/mod/slowmode.json", channel.id)
+        return False
+
+    async def slowmode_evictor(self):
+        """Forgets users whose slowmode interval has run out"""
+        while self == self.bot.get_cog("Mod"):
+            timestamp_now = int(time.time())
+            evicted = []
+            for channel_id, slowmode_channel in self.slowmode.items():
+                interval = slowmode_channel["interval"]
+                users = slowmode_channel["users"]
+                expired = [u for u, t in users.items()
+                           if t + interval <= timestamp_now]
+                for user_id in expired:
+                    del users[user_id]
+                if expired:
+                    evicted.append(channel_id)
+            if evicted:
+                dataIO.mark_dirty("data/mod/slowmode.json", *evicted)
+            await asyncio.sleep(60)
 
     @commands.command(pass_context=True, no_pm=True, name="slowmode")
     @checks.mod_or_permissions(administrator=True)
@@ -1742,26 +1732,21 @@ class Mod:
         channel = context.message.channel
         if int(interval) == 0:
             # disable slowmode
-            for slowmode_channel in self.slowmode_channels:
-                if "channel_id" in slowmode_channel and slowmode_channel["channel_id"] != "" \
-                and "interval" in slowmode_channel and slowmode_channel["interval"] != "" \
-                and "slowmode_users" in slowmode_channel:
-                    if slowmode_channel["channel_id"] == channel.id:
-                        self.slowmode_channels.remove(slowmode_channel)
-                        await self.bot.say(":runner: Slowmode disabled in this channel!")
-                        return
+            if channel.id in self.slowmode:
+                del self.slowmode[channel.id]
+                dataIO.mark_dirty("data/mod/slowmode.json", channel.id)
+                await self.bot.say(":runner: Slowmode disabled in this channel!")
+                return
             await self.bot.say(":warning: Slowmode is not enabled in this channel!")
         else:
             # enable slowmode
-            for slowmode_channel in self.slowmode_channels:
-                if "channel_id" in slowmode_channel and slowmode_channel["channel_id"] != "" \
-                and "interval" in slowmode_channel and slowmode_channel["interval"] != "" \
-                and "slowmode_users" in slowmode_channel:
-                    if slowmode_channel["channel_id"] == channel.id:
-                        slowmode_channel["interval"] = int(interval)
-                        await self.bot.say(":snail: Slowmode interval changed to {0} seconds!".format(int(interval)))
-                        return
-            self.slowmode_channels.append({"channel_id": channel.id, "interval": int(interval), "slowmode_users": []})
+            if channel.id in self.slowmode:
+                self.slowmode[channel.id]["interval"] = int(interval)
+                dataIO.mark_dirty("data/mod/slowmode.json", channel.id)
+                await self.bot.say(":snail: Slowmode interval changed to {0} seconds!".format(int(interval)))
+                return
+            self.slowmode[channel.id] = {"interval": int(interval), "users": {}}
+            dataIO.mark_dirty("data/mod/slowmode.json", channel.id)
             await self.bot.say(":snail: Slowmode enabled! (interval: {0} seconds)".format(int(interval)))
 
     async def _yes_or_no_reaction(self, message, user):
@@ -1828,7 +1813,8 @@ def check_files():
         "past_nicknames.json" : {},
         "settings.json"       : {},
         "modlog.json"         : {},
-        "perms_cache.json"    : {}
+        "perms_cache.json"    : {},
+        "slowmode.json"       : {}
     }
 
     for filename, value in files.items():
@@ -1852,4 +1838,6 @@ def setup(bot):
         logger.addHandler(handler)
     n = Mod(bot)
     bot.add_listener(n.check_names, "on_member_update")
+    bot.add_message_listener(n.check_message)
     bot.add_cog(n)
+    bot.loop.create_task(n.slowmode_evictor())
@@ -2,9 +2,82 @@ import discord
 from discord.ext import commands
 from __main__ import send_cmd_help
 import os
+import asyncio
+import time
+from collections import OrderedDict
 from .utils.dataIO import dataIO
+from .utils.chat_formatting import pagify
 from cogs.utils import checks
 
+BOUNDARIES = " ,\""
+
+# Hits for the same user within this many seconds of a DM are held
+# and sent together as the next one
+COALESCE_SECONDS = 10
+# How many DMs may be in flight at once
+WORKERS = 3
+# Users waiting for a DM before further hits get dropped
+MAX_PENDING = 1000
+PAGE_LENGTH = 2000
+
+
+class KeywordIndex:
+    """Trie of keywords matched in a single pass over a message
+
+    A keyword matches when it's surrounded by the start or end of the
+    message, spaces, commas or double quotes."""
+
+    def __init__(self):
+        self.root = {}
+        self.users = {}
+
+    def add(self, keyword, user_id):
+        if keyword not in self.users:
+            node = self.root
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[None] = keyword
+            self.users[keyword] = set()
+        self.users[keyword].add(user_id)
+
+    def remove(self, keyword, user_id):
+        users = self.users.get(keyword)
+        if users is None:
+            return
+        users.discard(user_id)
+        if users:
+            return
+        del self.users[keyword]
+        path = [self.root]
+        for char in keyword:
+            path.append(path[-1][char])
+        del path[-1][None]
+        # Prune the branches no other keyword goes through
+        for i in range(len(keyword), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][keyword[i - 1]]
+
+    def find(self, text):
+        """Returns the keywords found in text"""
+        found = set()
+        if not self.users:
+            return found
+        length = len(text)
+        for start in range(length):
+            if start and text[start - 1] not in BOUNDARIES:
+                continue
+            node = self.root
+            for end in range(start, length):
+                node = node.get(text[end])
+                if node is None:
+                    break
+                if None in node and (end + 1 == length or
+                                     text[end + 1] in BOUNDARIES):
+                    found.add(node[None])
+        return found
+
+
 class Notifications:
     """Get notifications for keywords"""
 
@@ -12,6 +85,39 @@ class Notifications:
         self.bot = bot
         self.keywords_file_path = "data/notifications/keywords.json"
         self.keywords = dataIO.load_json(self.keywords_file_path)
+        self.indexes = {}
+        for key, keywords in self.keywords.items():
+            for keywordData in keywords:
+                self._index(key).add(keywordData["keyword"],
+                                     keywordData["userId"])
+        self.pending = OrderedDict()
+        # user ID: when their last DM was dispatched, oldest first
+        self.last_dm = OrderedDict()
+        self.ready = asyncio.Queue(loop=self.bot.loop)
+        self.dispatch_stats = {"queued": 0, "coalesced": 0, "dropped": 0,
+                               "sent": 0, "failed": 0, "latency": 0.0,
+                               "max_latency": 0.0}
+        self.workers = [self.bot.loop.create_task(self._dispatch_worker())
+                        for i in range(WORKERS)]
+
+    def __unload(self):
+        for worker in self.workers:
+            worker.cancel()
+        # Hits still held back are sent now instead of getting lost
+        pending = list(self.pending.items())
+        self.pending.clear()
+        self.bot.loop.create_task(self._send_all(pending))
+
+    def watched_servers(self):
+        """Servers with keywords, or None if there are global keywords"""
+        if self.indexes.get("global") and self.indexes["global"].users:
+            return None
+        return [k for k, index in self.indexes.items() if index.users]
+
+    def _index(self, key):
+        if key not in self.indexes:
+            self.indexes[key] = KeywordIndex()
+        return self.indexes[key]
 
     @commands.group(pass_context=True, no_pm=True, name="notifications", aliases=["notification", "noti"])
     async def _notifications(self, ctx):
@@ -40,6 +146,8 @@ class Notifications:
 
         keywordData = {"userId": author.id, "keyword": keyword}
         self.keywords[server.id].append(keywordData)
+        self._index(server.id).add(keyword, author.id)
+        self.bot.route_message_listener(self.check_keyword, servers=self.watched_servers())
 
         dataIO.save_json(self.keywords_file_path, self.keywords)
 
@@ -65,6 +173,8 @@ class Notifications:
         for keywordData in self.keywords[server.id]:
             if keywordData["userId"] == author.id and keywordData["keyword"] == keyword:
                 del(self.keywords[server.id][self.keywords[server.id].index(keywordData)])
+                self._index(server.id).remove(keyword, author.id)
+                self.bot.route_message_listener(self.check_keyword, servers=self.watched_servers())
                 dataIO.save_json(self.keywords_file_path, self.keywords)
 
                 await self.bot.delete_message(message)
@@ -110,6 +220,19 @@ class Notifications:
         await self.bot.say("{0} Please check your DMs".format(author.mention))
         await self.bot.send_message(author, keywordsMessage)
 
+    @_notifications.command(name="stats")
+    @checks.is_owner()
+    async def _stats(self):
+        """Shows the notification dispatch queue"""
+        stats = self.dispatch_stats
+        sent = stats["sent"] or 1
+        msg = ("Waiting: {}\nQueued: {queued}\nCoalesced: {coalesced}\n"
+               "Dropped: {dropped}\nSent: {sent}\nFailed: {failed}\n"
+               "Average latency: {:.2f}s\nMax latency: {max_latency:.2f}s"
+               "".format(len(self.pending), stats["latency"] / sent,
+                         **stats))
+        await self.bot.say("```{}```".format(msg))
+
     @_notifications.group(pass_context=True, name="global")
     @checks.is_owner()
     async def _global(self, ctx):
@@ -137,6 +260,8 @@ class Notifications:
 
         keywordData = {"userId": author.id, "keyword": keyword}
         self.keywords["global"].append(keywordData)
+        self._index("global").add(keyword, author.id)
+        self.bot.route_message_listener(self.check_keyword, servers=self.watched_servers())
 
         dataIO.save_json(self.keywords_file_path, self.keywords)
 
@@ -160,6 +285,8 @@ class Notifications:
         for keywordData in self.keywords["global"]:
             if keywordData["userId"] == author.id and keywordData["keyword"] == keyword:
                 del(self.keywords["global"][self.keywords["global"].index(keywordData)])
+                self._index("global").remove(keyword, author.id)
+                self.bot.route_message_listener(self.check_keyword, servers=self.watched_servers())
                 dataIO.save_json(self.keywords_file_path, self.keywords)
 
                 await self.bot.say("{0} Removed keyword `{1}` from your **global** list! :ok_hand:".format(author.mention, keyword))
@@ -202,91 +329,132 @@ class Notifications:
         await self.bot.say("{0} Please check your DMs".format(author.mention))
         await self.bot.send_message(author, keywordsMessage)
 
-    async def check_keyword(self, message):
+    async def check_keyword(self, parsed):
+        message = parsed.message
         server = message.server
-        author = message.author
 
-        if message.server is None:
+        if message.content.startswith(("+", "-")):
             return
 
-        if message.channel.is_private:
+        indexes = [self.indexes[k] for k in (server.id, "global")
+                   if k in self.indexes]
+        if not indexes:
             return
 
-        if author == self.bot.user:
+        content = parsed.lower
+        keywordsForUser = {}
+        for index in indexes:
+            for keyword in index.find(content):
+                for userId in index.users[keyword]:
+                    userToNotify = message.server.get_member(userId)
+                    if userToNotify == None:
+                        print("user #{0} for keyword notification \"{1}\" not found!".format(userId, keyword))
+                        continue
+
+                    if userToNotify == message.author:
+                        continue
+
+                    userToNotifyPermissions = message.channel.permissions_for(userToNotify)
+                    if userToNotifyPermissions.read_message_history == True:
+                        if userToNotify not in keywordsForUser:
+                            keywordsForUser[userToNotify] = [keyword]
+                        elif keyword not in keywordsForUser[userToNotify]:
+                            keywordsForUser[userToNotify].append(keyword)
+        for user, keywords in keywordsForUser.items():
+            self._queue_notification(user, message, keywords)
+
+    def _queue_notification(self, user, message, keywords):
+        """Adds a hit to the user's pending DM
+
+        A hit for a user who wasn't sent a DM in the last
+        COALESCE_SECONDS goes out right away. Otherwise it's held until
+        that much time has passed since their last DM, and everything
+        else that comes in for them until then ends up in the same DM.
+        Never waits, the workers do the sending."""
+        entry = self.pending.get(user.id)
+        if entry is not None:
+            entry["hits"].append((message, keywords))
+            self.dispatch_stats["coalesced"] += 1
             return
-
-        if self._is_command(message.content):
+        if len(self.pending) >= MAX_PENDING:
+            self.dispatch_stats["dropped"] += 1
             return
-
-        all_requested_keywords = []
-        if server.id in self.keywords:
-            all_requested_keywords += self.keywords[server.id]
-        if "global" in self.keywords:
-            all_requested_keywords += self.keywords["global"]
-
-        if len(all_requested_keywords) <= 0:
+        now = time.monotonic()
+        while self.last_dm:
+            user_id, sent_at = next(iter(self.last_dm.items()))
+            if now - sent_at < COALESCE_SECONDS:
+                break
+            del self.last_dm[user_id]
+        self.pending[user.id] = {"user": user, "hits": [(message, keywords)],
+                                 "since": now}
+        self.dispatch_stats["queued"] += 1
+        if user.id in self.last_dm:
+            delay = self.last_dm[user.id] + COALESCE_SECONDS - now
+            self.bot.loop.call_later(delay, self.ready.put_nowait, user.id)
+        else:
+            self.ready.put_nowait(user.id)
+
+    async def _dispatch_worker(self):
+        while True:
+            user_id = await self.ready.get()
+            entry = self.pending.pop(user_id, None)
+            if entry is None:
+                continue
+            self.last_dm.pop(user_id, None)
+            self.last_dm[user_id] = time.monotonic()
+            await self._send(user_id, entry)
+
+    async def _send_all(self, entries):
+        for user_id, entry in entries:
+            await self._send(user_id, entry)
+
+    async def _send(self, user_id, entry):
+        try:
+            for page in self._format_hits(entry["hits"]):
+                await self.bot.send_message(entry["user"], page)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.dispatch_stats["failed"] += 1
+            print("Keyword notification for user #{0} failed: {1}".format(user_id, e))
             return
-
-        toNotifyUserForList = {}
-        for keywordData in all_requested_keywords:
-            if self._words_in_text(message.content.lower(), keywordData["keyword"]):
-                userToNotify = message.server.get_member(keywordData["userId"])
-                if userToNotify == None:
-                    print("user #{0[userId]} for keyword notification \"{0[keyword]}\" not found!")
-                    continue
-
-                if userToNotify == message.author:
-                    continue
-
-                userToNotifyPermissions = message.channel.permissions_for(userToNotify)
-                if userToNotifyPermissions.read_message_history == True:
-                    if keywordData["keyword"] not in toNotifyUserForList:
-                        toNotifyUserForList[keywordData["keyword"]] = {userToNotify}
-                    else:
-                        toNotifyUserForList[keywordData["keyword"]].add(userToNotify)
-        if len(toNotifyUserForList) > 0:
+        latency = time.monotonic() - entry["since"]
+        self.dispatch_stats["sent"] += 1
+        self.dispatch_stats["latency"] += latency
+        self.dispatch_stats["max_latency"] = max(
+            latency, self.dispatch_stats["max_latency"])
+
+    def _format_hits(self, hits):
+        """Returns the pages of a DM listing hits
+
+        Message contents are split before being put in code blocks, so
+        a page never ends inside one."""
+        pages = []
+        page = ""
+        for message, keywords in hits:
             keywordListText = ""
             i = 0
-            for keyword, users in toNotifyUserForList.items():
+            for keyword in keywords:
                 i += 1
                 if i == 1:
                     keywordListText += "`{0}`".format(keyword)
-                elif i < len(toNotifyUserForList):
+                elif i < len(keywords):
                     keywordListText += ", `{0}`".format(keyword)
                 else:
                     keywordListText += " and `{0}`".format(keyword)
-            for user in users:
-                notifyMessage = ":bell: User {0.author.name} ({0.author.mention}) mentioned {1} in {0.channel.mention} on the `{0.server.name}` server:\n```{0.content}```".format(message, keywordListText)
-                await self.bot.send_message(user, notifyMessage)
-
-    def _words_in_text(self, haystack, needle):
-        if haystack == needle:
-            return True
-        if haystack.startswith(needle + " "):
-            return True
-        if haystack.endswith(" " + needle):
-            return True
-        if haystack.find(" " + needle + " ") != -1:
-            return True
-        if haystack.find(" " + needle + ",") != -1:
-            return True
-        if haystack.find("," + needle + " ") != -1:
-            return True
-        if haystack.find("\"" + needle + " ") != -1:
-            return True
-        if haystack.find(" " + needle + "\"") != -1:
-            return True
-        if haystack.find("\"" + needle + "\"") != -1:
-            return True
-        return False
-
-    def _is_command(self, msg):
-        for p in self.bot.settings.prefixes:
-            if msg.startswith(p):
-                return True
-        if msg.startswith("+") or msg.startswith("-"):
-            return True
-        return False
+            parts = [":bell: User {0.author.name} ({0.author.mention}) mentioned {1} in {0.channel.mention} on the `{0.server.name}` server:".format(message, keywordListText)]
+            parts.extend("```{}```".format(p) for p in
+                         pagify(message.content, escape=False,
+                                shorten_by=6, page_length=PAGE_LENGTH))
+            for part in parts:
+                if page and len(page) + 1 + len(part) > PAGE_LENGTH:
+                    pages.append(page)
+                    page = part
+                else:
+                    page = page + "\n" + part if page else part
+        if page:
+            pages.append(page)
+        return pages
 
 def check_folders():
     folders = ("data", "data/notifications/")
@@ -306,5 +474,6 @@ def setup(bot):
     check_folders()
     check_files()
     n = Notifications(bot)
-    bot.add_listener(n.check_keyword, "on_message")
+    bot.add_message_listener(n.check_keyword, commands=False,
+                             servers=n.watched_servers())
     bot.add_cog(n)
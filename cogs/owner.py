@@ -615,6 +615,70 @@ class Owner:
             except:
                 pass
 
+    @commands.group(name="profile", pass_context=True,
+                    invoke_without_command=True)
+    @checks.is_owner()
+    async def _profile(self, ctx, count: int=10):
+        """Shows the slowest listeners and commands
+
+        Sorted by their 95th percentile over the last sampled calls"""
+        profiler = self.bot.profiler
+        rows = profiler.top(count)
+        if not rows:
+            await self.bot.say("Nothing profiled yet. Sample rate is {:.0%}, "
+                               "change it with `{}profile rate`."
+                               "".format(profiler.sample_rate, ctx.prefix))
+            return
+        msg = "{:<40} {:>7} {:>9} {:>9} {:>9} {:>5}\n".format(
+            "Name", "Calls", "p50 ms", "p95 ms", "p99 ms", "Slow")
+        for name, calls, p50, p95, p99, slow in rows:
+            msg += "{:<40} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>5}\n".format(
+                name[:40], calls, p50 * 1000, p95 * 1000, p99 * 1000, slow)
+        msg += "\nSample rate {:.0%}, slow threshold {}s".format(
+            profiler.sample_rate, profiler.slow_threshold)
+        for page in pagify(msg, ["\n"], shorten_by=16):
+            await self.bot.say(box(page))
+
+    @_profile.command(name="rate")
+    @checks.is_owner()
+    async def _profile_rate(self, rate: float):
+        """Sets the share of calls that are timed, 0 to 1
+
+        0 turns profiling off. Event listeners added while it was off
+        are only profiled once their cog is reloaded."""
+        if not 0 <= rate <= 1:
+            await self.bot.say("The rate has to be between 0 and 1.")
+            return
+        self.bot.profiler.sample_rate = rate
+        self.bot.settings.profile_sample_rate = rate
+        self.bot.settings.save_settings()
+        await self.bot.say("Profiling {:.0%} of the calls.".format(rate))
+
+    @_profile.command(name="stalls")
+    @checks.is_owner()
+    async def _profile_stalls(self):
+        """Shows how often each cog blocked the event loop"""
+        watchdog = self.bot.watchdog
+        if watchdog is None:
+            await self.bot.say("The event loop watchdog is disabled.")
+            return
+        if not watchdog.stalls:
+            await self.bot.say("No event loop stalls over {}s so far."
+                               "".format(watchdog.threshold))
+            return
+        msg = "Event loop stalls over {}s:\n".format(watchdog.threshold)
+        for cog, count in watchdog.stalls.most_common():
+            msg += "{:<30} {:>6}\n".format(cog, count)
+        for page in pagify(msg, ["\n"], shorten_by=16):
+            await self.bot.say(box(page))
+
+    @_profile.command(name="reset")
+    @checks.is_owner()
+    async def _profile_reset(self):
+        """Clears the collected timings"""
+        self.bot.profiler.reset()
+        await self.bot.say("Profiler timings cleared.")
+
     @commands.command()
     @checks.is_owner()
     async def join(self, invite_url: discord.Invite=None):
@@ -926,16 +990,9 @@ class Owner:
 
         return embed
 
-    async def check_mention(self, message):
+    async def check_mention(self, parsed):
+        message = parsed.message
         channel = message.channel
-        author = message.author
-        server = message.server
-
-        if message.server is None:
-            return
-
-        if author == self.bot.user:
-            return
 
         if not self.bot.user_allowed(message):
             return
@@ -986,5 +1043,5 @@ def check_files():
 def setup(bot):
     check_files()
     n = Owner(bot)
-    bot.add_listener(n.check_mention, "on_message")
+    bot.add_message_listener(n.check_mention)
     bot.add_cog(n)
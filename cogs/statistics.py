@@ -6,12 +6,51 @@ import asyncio
 import discord
 import time
 import os
+from collections import deque, Counter
 
 try:
     import psutil
 except:
     psutil = False
 
+SETTINGS = 'data/statistics/settings.json'
+RECOUNT_INTERVAL = 600
+# Servers becoming available in a burst share one recount
+RECOUNT_DELAY = 5
+
+
+class RateHistogram:
+    """Event counts bucketed per minute, for the last `minutes` minutes"""
+
+    def __init__(self, minutes=60):
+        self.buckets = deque([0] * minutes, maxlen=minutes)
+        self.minute = int(time.time() // 60)
+
+    def add(self, n=1):
+        self._roll()
+        self.buckets[-1] += n
+
+    def last_minute(self):
+        """Count of the last complete minute"""
+        self._roll()
+        return self.buckets[-2]
+
+    def average(self):
+        """Per minute average over the complete minutes kept"""
+        self._roll()
+        return ((sum(self.buckets) - self.buckets[-1]) /
+                (len(self.buckets) - 1))
+
+    def peak(self):
+        self._roll()
+        return max(self.buckets)
+
+    def _roll(self):
+        now = int(time.time() // 60)
+        for i in range(min(now - self.minute, len(self.buckets))):
+            self.buckets.append(0)
+        self.minute = now
+
 
 class Statistics:
     """
@@ -19,10 +58,31 @@ class Statistics:
     """
     def __init__(self, bot):
         self.bot = bot
-        self.settings = dataIO.load_json('data/statistics/settings.json')
-        self.sent_messages = self.settings['SENT_MESSAGES']
-        self.received_messages = self.settings['RECEIVED_MESSAGES']
+        # Counted straight into the registered settings, the dataIO
+        # flusher writes them at most once per flush interval and once
+        # more when the bot shuts down
+        self.settings = dataIO.register(SETTINGS, dataIO.load_json(SETTINGS))
         self.refresh_rate = self.settings['REFRESH_RATE']
+        self.rates = {'received': RateHistogram(),
+                      'sent': RateHistogram(),
+                      'commands': RateHistogram()}
+        # Servers each user shares with the bot, and channels per type,
+        # kept up to date by events and recounted every RECOUNT_INTERVAL
+        self.member_servers = Counter()
+        self.channel_types = Counter()
+        self._recount_handle = None
+        # Channel and message the continuous updates are edited into
+        self.stats_channel = None
+        self.stats_message = None
+        self.last_embed = None
+
+    def __unload(self):
+        if self._recount_handle is not None:
+            self._recount_handle.cancel()
+        self.bot.remove_listener(self.command_ran, 'on_command')
+        for event, listener in self.listeners():
+            self.bot.remove_listener(listener, event)
+        dataIO.unregister(SETTINGS)
 
     async def _int(self, n):
         try:
@@ -54,7 +114,7 @@ class Statistics:
             else:
                 self.refresh_rate = seconds
                 self.settings['REFRESH_RATE'] = self.refresh_rate
-                dataIO.save_json('data/statistics/settings.json', self.settings)
+                dataIO.save_json(SETTINGS, self.settings)
                 message = '`Changed refresh rate to {} seconds`'.format(self.refresh_rate)
         await self.bot.say(message)
 
@@ -67,12 +127,13 @@ class Statistics:
         """
         if len(channel) > 0:
             self.settings['CHANNEL_ID'] = str(channel[0].id)
-            dataIO.save_json('data/statistics/settings.json', self.settings)
+            dataIO.save_json(SETTINGS, self.settings)
+            self.stats_channel = self.stats_message = None
             message = 'Channel set to {}'.format(channel[0].mention)
         elif not self.settings['CHANNEL_ID']:
             message = 'No channel set!'
         else:
-            channel = discord.utils.get(self.bot.get_all_channels(), id=self.settings['CHANNEL_ID'])
+            channel = self.bot.get_channel(self.settings['CHANNEL_ID'])
             message = 'Current channel is {}'.format(channel.mention)
         await self.bot.say(message)
 
@@ -86,21 +147,16 @@ class Statistics:
         days = up.days
         hours = int(up.seconds/3600)
         minutes = int(up.seconds % 3600/60)
-        users = str(len(set(self.bot.get_all_members())))
+        users = str(len(self.member_servers))
         servers = str(len(self.bot.servers))
-        text_channels = 0
-        voice_channels = 0
+        text_channels = self.channel_types[discord.ChannelType.text]
+        voice_channels = self.channel_types[discord.ChannelType.voice]
 
         cpu_p = psutil.cpu_percent(interval=None, percpu=True)
         cpu_usage = sum(cpu_p)/len(cpu_p)
 
         mem_v = psutil.virtual_memory()
 
-        for channel in self.bot.get_all_channels():
-            if channel.type == discord.ChannelType.text:
-                text_channels += 1
-            elif channel.type == discord.ChannelType.voice:
-                voice_channels += 1
         channels = text_channels + voice_channels
 
         em = discord.Embed(description='\a\n', color=discord.Color.red())
@@ -116,10 +172,18 @@ class Statistics:
         em.add_field(name='**Text channels**', value=str(text_channels))
         em.add_field(name='**Voice channels**', value=str(voice_channels))
 
-        em.add_field(name='**Messages received**', value=str(self.received_messages))
-        em.add_field(name='**Messages sent**', value=str(self.sent_messages))
+        em.add_field(name='**Messages received**', value=str(self.settings['RECEIVED_MESSAGES']))
+        em.add_field(name='**Messages sent**', value=str(self.settings['SENT_MESSAGES']))
         em.add_field(name='\a', value='\a')
 
+        rates = self.rates
+        em.add_field(name='**Received / min**',
+                     value=self._format_rate(rates['received']))
+        em.add_field(name='**Sent / min**',
+                     value=self._format_rate(rates['sent']))
+        em.add_field(name='**Commands / min**',
+                     value=self._format_rate(rates['commands']))
+
         em.add_field(name='**Active cogs**', value=str(len(self.bot.cogs)))
         em.add_field(name='**Commands**', value=str(len(self.bot.commands)))
         em.add_field(name='\a', value='\a')
@@ -132,32 +196,143 @@ class Statistics:
         em.set_footer(text='API version {}'.format(discord.__version__))
         return em
 
-    async def incoming_messages(self, message):
-        if message.author.id == self.bot.user.id:
-            self.sent_messages += 1
+    def _format_rate(self, rate):
+        return '{} (avg {:.1f}, peak {})'.format(rate.last_minute(),
+                                                 rate.average(), rate.peak())
+
+    async def incoming_messages(self, parsed):
+        if parsed.is_own:
+            self.settings['SENT_MESSAGES'] += 1
+            self.rates['sent'].add()
         else:
-            self.received_messages += 1
-        self.settings['SENT_MESSAGES'] = self.sent_messages
-        self.settings['RECEIVED_MESSAGES'] = self.received_messages
-        dataIO.save_json('data/statistics/settings.json', self.settings)
+            self.settings['RECEIVED_MESSAGES'] += 1
+            self.rates['received'].add()
+        dataIO.mark_dirty(SETTINGS)
+
+    async def command_ran(self, command, ctx):
+        self.rates['commands'].add()
+
+    def recount(self):
+        """Rebuilds the member and channel aggregates from the cache"""
+        members = Counter(m.id for m in self.bot.get_all_members())
+        channels = Counter(c.type for c in self.bot.get_all_channels())
+        self.member_servers = members
+        self.channel_types = channels
+
+    def schedule_recount(self):
+        """Recounts in RECOUNT_DELAY seconds unless one is pending"""
+        if self._recount_handle is None:
+            self._recount_handle = self.bot.loop.call_later(
+                RECOUNT_DELAY, self._scheduled_recount)
+
+    def _scheduled_recount(self):
+        self._recount_handle = None
+        self.recount()
+
+    def listeners(self):
+        # Servers that arrive with READY or become available again
+        # don't dispatch on_server_join, they're picked up by a recount
+        return [('on_ready', self.ready),
+                ('on_server_available', self.server_available),
+                ('on_member_join', self.member_join),
+                ('on_member_remove', self.member_remove),
+                ('on_server_join', self.server_join),
+                ('on_server_remove', self.server_remove),
+                ('on_channel_create', self.channel_create),
+                ('on_channel_delete', self.channel_delete),
+                ('on_channel_update', self.channel_update)]
+
+    async def ready(self):
+        self.recount()
+
+    async def server_available(self, server):
+        self.schedule_recount()
+
+    async def member_join(self, member):
+        self.member_servers[member.id] += 1
+
+    async def member_remove(self, member):
+        self._forget_member(member.id)
+
+    async def server_join(self, server):
+        for member in server.members:
+            self.member_servers[member.id] += 1
+        for channel in server.channels:
+            self.channel_types[channel.type] += 1
+
+    async def server_remove(self, server):
+        for member in server.members:
+            self._forget_member(member.id)
+        for channel in server.channels:
+            self.channel_types[channel.type] -= 1
+
+    async def channel_create(self, channel):
+        if not channel.is_private:
+            self.channel_types[channel.type] += 1
+
+    async def channel_delete(self, channel):
+        if not channel.is_private:
+            self.channel_types[channel.type] -= 1
+
+    async def channel_update(self, before, after):
+        if not after.is_private and before.type != after.type:
+            self.channel_types[before.type] -= 1
+            self.channel_types[after.type] += 1
+
+    def _forget_member(self, user_id):
+        self.member_servers[user_id] -= 1
+        if self.member_servers[user_id] <= 0:
+            del self.member_servers[user_id]
+
+    async def recount_loop(self):
+        await self.bot.wait_until_ready()
+        while self == self.bot.get_cog('Statistics'):
+            self.recount()
+            await asyncio.sleep(RECOUNT_INTERVAL)
 
     async def reload_stats(self):
         await asyncio.sleep(30)
         while self == self.bot.get_cog('Statistics'):
             if self.settings['CHANNEL_ID']:
                 msg = await self.retrieve_statistics()
-                channel = discord.utils.get(self.bot.get_all_channels(), id=self.settings['CHANNEL_ID'])
-                messages = False
-                async for message in self.bot.logs_from(channel, limit=1):
-                    messages = True
-                    if message.author.name == self.bot.user.name:
-                        await self.bot.edit_message(message, embed=msg)
-                if not messages:
-                    await self.bot.send_message(channel, embed=msg)
-            else:
-                pass
+                try:
+                    await self.update_stats_message(msg)
+                except discord.HTTPException as e:
+                    print('Statistics: could not update the stats '
+                          'message: {}'.format(e))
             await asyncio.sleep(self.refresh_rate)
 
+    async def update_stats_message(self, msg):
+        channel = self.stats_channel
+        if channel is None or channel.id != self.settings['CHANNEL_ID']:
+            channel = self.bot.get_channel(self.settings['CHANNEL_ID'])
+            if channel is None:
+                return
+            self.stats_channel = channel
+            self.stats_message = None
+        rendered = msg.to_dict()
+        if self.stats_message is not None:
+            if rendered == self.last_embed:
+                return
+            try:
+                await self.bot.edit_message(self.stats_message, embed=msg)
+                self.last_embed = rendered
+                return
+            except discord.NotFound:
+                self.stats_message = None
+        # No cached message or it was deleted, look at the history once
+        messages = False
+        async for message in self.bot.logs_from(channel, limit=1):
+            messages = True
+            if message.author.id == self.bot.user.id:
+                self.stats_message = await self.bot.edit_message(message,
+                                                                 embed=msg)
+                self.last_embed = rendered
+        if not messages:
+            self.stats_message = await self.bot.send_message(channel,
+                                                             embed=msg)
+            self.last_embed = rendered
+
 
 def check_folder():
     if not os.path.exists("data/statistics"):
@@ -185,5 +360,9 @@ def setup(bot):
         check_file()
         n = Statistics(bot)
         bot.add_cog(n)
-        bot.add_listener(n.incoming_messages, "on_message")
+        bot.add_message_listener(n.incoming_messages, private=True, own=True)
+        bot.add_listener(n.command_ran, 'on_command')
+        for event, listener in n.listeners():
+            bot.add_listener(listener, event)
         bot.loop.create_task(n.reload_stats())
+        bot.loop.create_task(n.recount_loop())
@@ -276,11 +276,11 @@ async def get_trivia_by_channel(channel):
                 return t
         return False
 
-async def check_messages(message):
-    if message.author.id != trivia_manager.bot.user.id:
-        if await get_trivia_by_channel(message.channel):
-            trvsession = await get_trivia_by_channel(message.channel)
-            await trvsession.check_answer(message)
+async def check_messages(parsed):
+    message = parsed.message
+    trvsession = await get_trivia_by_channel(message.channel)
+    if trvsession:
+        await trvsession.check_answer(message)
 
 
 def check_folders():
@@ -303,6 +303,6 @@ def setup(bot):
     global trivia_manager
     check_folders()
     check_files()
-    bot.add_listener(check_messages, "on_message")
+    bot.add_message_listener(check_messages, private=True)
     trivia_manager = Trivia(bot)
     bot.add_cog(trivia_manager)
@@ -51,18 +51,16 @@ def role_or_permissions(ctx, check, **perms):
 def mod_or_permissions(**perms):
     def predicate(ctx):
         server = ctx.message.server
-        mod_role = settings.get_server_mod(server).lower()
-        admin_role = settings.get_server_admin(server).lower()
-        submod_role = settings.get_server_submod(server).lower()
-        return role_or_permissions(ctx, lambda r: r.name.lower() in (mod_role,admin_role,submod_role), **perms)
+        ids = settings.get_server_role_ids(server)["ANY"]
+        return role_or_permissions(ctx, lambda r: r.id in ids, **perms)
 
     return commands.check(predicate)
 
 def admin_or_permissions(**perms):
     def predicate(ctx):
         server = ctx.message.server
-        admin_role = settings.get_server_admin(server)
-        return role_or_permissions(ctx, lambda r: r.name.lower() == admin_role.lower(), **perms)
+        ids = settings.get_server_role_ids(server)["ADMIN"]
+        return role_or_permissions(ctx, lambda r: r.id in ids, **perms)
 
     return commands.check(predicate)
 
@@ -1,7 +1,14 @@
+import asyncio
+import itertools
 import json
 import os
 import logging
-from random import randint
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from copy import deepcopy
+from .sqlitestore import SQLiteStore
 
 class InvalidFileIO(Exception):
     pass
@@ -9,12 +16,39 @@ class InvalidFileIO(Exception):
 class DataIO():
     def __init__(self):
         self.logger = logging.getLogger("red")
+        self.flush_interval = 5
+        self._stores = {}
+        self._dirty = set()
+        self._dirty_keys = {}  # filename: top level keys that changed
+        self._flusher = None
+        self._flusher_loop = None
+        # Background writes run one at a time on their own thread,
+        # _writing is the one in progress
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._writing = None
+        # Serialized payloads are numbered, a write never replaces a
+        # file with an older payload than the one it already holds
+        self._payloads = itertools.count()
+        self._written = {}
+        self._write_lock = threading.Lock()
+        self.journal_limit = 1000
+        self._journals = {}
+        self._sqlite = None
+        self._sqlite_prefixes = ()
+        self._sqlite_data = {}
+        # Writes and bytes written per kind: json, journal and sqlite
+        self.writes = Counter()
+        self.bytes_written = Counter()
 
     def save_json(self, filename, data):
         """Atomically saves json file"""
-        rnd = randint(1000, 9999)
-        path, ext = os.path.splitext(filename)
-        tmp_file = "{}-{}.tmp".format(path, rnd)
+        if self._in_sqlite(filename):
+            self._count_write("sqlite", self._sqlite.save(filename, data))
+            if filename in self._sqlite_data:
+                self._sqlite_data[filename] = data
+            return True
+        with self._temp_file(filename) as f:
+            tmp_file = f.name
         self._save_json(tmp_file, data)
         try:
             self._read_json(tmp_file)
@@ -24,15 +58,30 @@ class DataIO():
                                   "The original file is unaltered."
                                   "".format(filename))
             return False
-        os.replace(tmp_file, filename)
+        self._count_write("json", os.path.getsize(tmp_file))
+        with self._write_lock:
+            os.replace(tmp_file, filename)
+            self._written[filename] = next(self._payloads)
+        if filename in self._journals:
+            # The snapshot now holds everything the journal did
+            self._journals[filename].reset()
+            self._journals[filename].data = data
         return True
 
     def load_json(self, filename):
         """Loads json file"""
+        if filename in self._dirty:
+            # A reloaded cog must not read what its previous
+            # instance has yet to write
+            self.flush(filename)
+        if self._in_sqlite(filename):
+            return self._sqlite_load(filename)
         return self._read_json(filename)
 
     def is_valid_json(self, filename):
         """Verifies if json file exists / is readable"""
+        if self._in_sqlite(filename) and self._sqlite.has(filename):
+            return True
         try:
             self._read_json(filename)
             return True
@@ -41,6 +90,327 @@ class DataIO():
         except json.decoder.JSONDecodeError:
             return False
 
+    def register(self, filename, data):
+        """Registers data as the in-memory copy of filename
+
+        Registered data is written back by the background flusher
+        after mark_dirty is called, at most once per flush interval
+        no matter how many times it was marked. Returns data."""
+        if filename in self._dirty and self._stores[filename] is not data:
+            self.flush(filename)
+        self._stores[filename] = data
+        return data
+
+    def unregister(self, filename):
+        """Flushes pending changes and forgets about filename"""
+        if filename in self._dirty:
+            self.flush(filename)
+        self._stores.pop(filename, None)
+
+    def mark_dirty(self, filename, *keys):
+        """Schedules a registered file to be written on the next flush
+
+        Files kept in SQLite only compare the rows of the given top
+        level keys when they are, instead of the whole file."""
+        if filename not in self._stores:
+            raise InvalidFileIO("{} is not registered".format(filename))
+        if not keys:
+            self._dirty_keys.pop(filename, None)
+        elif filename not in self._dirty or filename in self._dirty_keys:
+            self._dirty_keys.setdefault(filename, set()).update(keys)
+        self._dirty.add(filename)
+
+    def _take_dirty(self, filename):
+        """Clears filename's dirty flag, returns its changed keys"""
+        self._dirty.discard(filename)
+        return self._dirty_keys.pop(filename, None)
+
+    def _restore_dirty(self, filename, keys):
+        if keys is None:
+            self.mark_dirty(filename)
+        else:
+            self.mark_dirty(filename, *keys)
+
+    def flush(self, filename=None):
+        """Synchronously writes dirty registered files
+
+        If filename is None every dirty file is written.
+        Returns False if any of them could not be saved."""
+        if filename is None:
+            filenames = list(self._dirty)
+        elif filename in self._dirty:
+            filenames = [filename]
+        else:
+            return True
+        ok = True
+        for f in filenames:
+            keys = self._take_dirty(f)
+            try:
+                self._write_store(f, self._stores[f], keys)
+            except Exception:
+                self.logger.exception("Write-behind flush of {} failed"
+                                      "".format(f))
+                self._restore_dirty(f, keys)
+                ok = False
+        return ok
+
+    def start_flusher(self, loop, interval=None):
+        """Starts the background flusher on loop if not already running"""
+        if interval is not None:
+            self.flush_interval = interval
+        if self._flusher is None or self._flusher.done():
+            self._flusher = loop.create_task(self._flush_loop(loop))
+            self._flusher_loop = loop
+        return self._flusher
+
+    def stop_flusher(self):
+        """Stops the background flusher and writes what's pending"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            loop = self._flusher_loop
+            if not loop.is_running() and not loop.is_closed():
+                # Nothing else will run the cancellation, the task would
+                # be destroyed pending when the loop is closed
+                try:
+                    loop.run_until_complete(self._flusher)
+                except asyncio.CancelledError:
+                    pass
+            self._flusher = None
+        if self._writing is not None:
+            # Cancelling doesn't stop a write already on the thread
+            wait([self._writing])
+            self._writing = None
+        self.compact()
+        return self.flush()
+
+    async def _write_in_background(self, loop, filename, payload):
+        self._writing = self._executor.submit(self._write_atomic,
+                                              filename, payload)
+        return await asyncio.wrap_future(self._writing, loop=loop)
+
+    async def _flush_loop(self, loop):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for filename in list(self._dirty):
+                keys = self._take_dirty(filename)
+                # Serialized on the loop so the data can't change under
+                # us, written in the executor so the loop doesn't wait
+                # for the disk
+                try:
+                    if self._in_sqlite(filename):
+                        # Only the rows of the changed keys get
+                        # serialized, when the cog said which they are
+                        self._count_write("sqlite", self._sqlite.save(
+                            filename, self._stores[filename], keys))
+                        continue
+                    payload = self._serialize(self._stores[filename])
+                    size = await self._write_in_background(loop, filename,
+                                                           payload)
+                    self._count_write("json", size)
+                except asyncio.CancelledError:
+                    self._restore_dirty(filename, keys)
+                    raise
+                except Exception:
+                    self.logger.exception("Write-behind flush of {} failed"
+                                          "".format(filename))
+                    self._restore_dirty(filename, keys)
+            await self._compact_pending(loop)
+
+    def load_journaled(self, filename, row_depth=1):
+        """Loads filename and replays its journal on top of it
+
+        The returned data is kept in memory and updated through
+        journal_set / journal_delete, which append a single line to
+        the journal instead of rewriting the whole file. The journal
+        is compacted into filename in the background once it grows
+        past journal_limit entries.
+
+        Files kept in SQLite are updated row by row instead, with a row
+        for every entry row_depth levels down."""
+        if self._in_sqlite(filename):
+            self._sqlite.set_depth(filename, row_depth)
+            data = self._sqlite_data[filename] = self._sqlite_load(filename)
+            return data
+        if filename in self._journals:
+            self._journals[filename].close()
+        data = self._read_json(filename)
+        journal = _Journal(filename, data)
+        journal.replay()
+        self._journals[filename] = journal
+        return data
+
+    def journal_set(self, filename, path, value):
+        """Sets data[path[0]][path[1]]... to value and journals it"""
+        if filename in self._sqlite_data:
+            return self._sqlite_apply(filename, "set", path, value)
+        self._count_write("journal",
+                          self._journal(filename).apply("set", path, value))
+
+    def journal_delete(self, filename, path):
+        """Deletes data[path[0]][path[1]]... and journals it"""
+        if filename in self._sqlite_data:
+            return self._sqlite_apply(filename, "del", path)
+        self._count_write("journal",
+                          self._journal(filename).apply("del", path))
+
+    def use_sqlite(self, path, prefixes):
+        """Keeps every file whose path starts with one of prefixes in
+        the SQLite database at path instead of in JSON files
+
+        Existing JSON files are imported the first time they're loaded."""
+        self._sqlite = SQLiteStore(path)
+        self._sqlite_prefixes = tuple(prefixes)
+
+    def open_store(self, filename, row_depth=1):
+        """Prepares filename for store_get / store_put / store_delete
+
+        Files kept in SQLite are then read and written an entry at a
+        time through the primary key index, with a row for every entry
+        row_depth levels down, and aren't held in memory. Other files
+        are loaded with load_journaled and served from memory."""
+        if not self._in_sqlite(filename):
+            self.load_journaled(filename)
+            return
+        self._sqlite.set_depth(filename, row_depth)
+        if not self._sqlite.has(filename):
+            self._sqlite_load(filename)
+
+    def store_get(self, filename, path):
+        """Returns a copy of data[path[0]][path[1]]...
+
+        Raises KeyError if there's no such entry."""
+        if self._in_sqlite(filename):
+            return self._sqlite.get(filename, path)
+        node = self._journal(filename).data
+        for key in path:
+            node = node[key]
+        return deepcopy(node)
+
+    def store_put(self, filename, path, value):
+        """Sets data[path[0]][path[1]]... to value"""
+        if not self._in_sqlite(filename):
+            return self.journal_set(filename, path, value)
+        self._count_write("sqlite", self._sqlite.put(filename, path, value))
+        if filename in self._sqlite_data:
+            _apply_entry(self._sqlite_data[filename],
+                         {"op": "set", "path": path, "value": value})
+
+    def store_delete(self, filename, path):
+        """Deletes data[path[0]][path[1]]..."""
+        if not self._in_sqlite(filename):
+            return self.journal_delete(filename, path)
+        self._count_write("sqlite", self._sqlite.delete(filename, path))
+        if filename in self._sqlite_data:
+            _apply_entry(self._sqlite_data[filename],
+                         {"op": "del", "path": path})
+
+    def _in_sqlite(self, filename):
+        return (self._sqlite is not None and
+                filename.startswith(self._sqlite_prefixes))
+
+    def _sqlite_load(self, filename):
+        if not self._sqlite.has(filename):
+            self._count_write("sqlite", self._sqlite.save(
+                filename, self._read_json(filename)))
+        return self._sqlite.load(filename)
+
+    def _sqlite_apply(self, filename, op, path, value=None):
+        _apply_entry(self._sqlite_data[filename],
+                     {"op": op, "path": path, "value": value})
+        if op == "set":
+            size = self._sqlite.put(filename, path, value)
+        else:
+            size = self._sqlite.delete(filename, path)
+        self._count_write("sqlite", size)
+
+    def _journal(self, filename):
+        try:
+            return self._journals[filename]
+        except KeyError:
+            raise InvalidFileIO("{} was not loaded with load_journaled"
+                                "".format(filename))
+
+    def compact(self, filename=None):
+        """Synchronously folds journals into their snapshot files"""
+        if filename is None:
+            journals = list(self._journals.values())
+        else:
+            journals = [self._journal(filename)]
+        for journal in journals:
+            if not journal.entries and not journal.rotated:
+                continue
+            try:
+                payload = self._serialize(journal.data)
+                journal.rotate()
+                self._count_write("json", self._write_atomic(
+                    journal.filename, payload))
+                journal.drop_rotated()
+            except Exception:
+                self.logger.exception("Compaction of {} failed"
+                                      "".format(journal.filename))
+
+    async def _compact_pending(self, loop):
+        for journal in list(self._journals.values()):
+            if journal.entries < self.journal_limit:
+                continue
+            try:
+                # Rotating on the loop means appends made while the
+                # snapshot is being written land in a fresh journal
+                payload = self._serialize(journal.data)
+                journal.rotate()
+                size = await self._write_in_background(
+                    loop, journal.filename, payload)
+                self._count_write("json", size)
+                journal.drop_rotated()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.exception("Compaction of {} failed"
+                                      "".format(journal.filename))
+
+    def _write_store(self, filename, data, keys=None):
+        if self._in_sqlite(filename):
+            self._count_write("sqlite",
+                              self._sqlite.save(filename, data, keys))
+        else:
+            payload = self._serialize(data)
+            self._count_write("json", self._write_atomic(filename, payload))
+
+    def _count_write(self, kind, size):
+        if size is None:
+            return
+        self.writes[kind] += 1
+        self.bytes_written[kind] += size
+
+    def _serialize(self, data):
+        # Serializing fully before touching the disk means a failure
+        # leaves the original file unaltered without a re-read check
+        return next(self._payloads), json.dumps(data, indent=4,
+                                                sort_keys=True,
+                                                separators=(',', ' : '))
+
+    def _write_atomic(self, filename, payload):
+        """Writes a payload from _serialize to filename, returns the
+        bytes written
+
+        Nothing is written and None is returned if filename already
+        holds a newer payload."""
+        number, text = payload
+        with self._write_lock:
+            if self._written.get(filename, -1) > number:
+                return None
+            with self._temp_file(filename) as f:
+                f.write(text)
+            os.replace(f.name, filename)
+            self._written[filename] = number
+        return len(text.encode("utf-8"))
+
+    def _temp_file(self, filename):
+        path, ext = os.path.splitext(filename)
+        return tempfile.NamedTemporaryFile(
+            mode="w", encoding="utf-8", dir=os.path.dirname(path) or ".",
+            prefix=os.path.basename(path) + "-", suffix=".tmp", delete=False)
+
     def _read_json(self, filename):
         with open(filename, encoding='utf-8', mode="r") as f:
             data = json.load(f)
@@ -64,6 +434,107 @@ class DataIO():
             raise InvalidFileIO("FileIO was called with invalid"
                 " parameters")
 
+class _Journal():
+    """Append-only change log kept next to a JSON snapshot
+
+    Entries only ever set or delete a value at a key path, so replaying
+    one that already made it into the snapshot is harmless."""
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.data = data
+        path, ext = os.path.splitext(filename)
+        self.path = path + ".journal"
+        self.rotated_path = path + ".journal.old"
+        self.entries = 0
+        self.rotated = os.path.isfile(self.rotated_path)
+        self._handle = None
+
+    def replay(self):
+        for path in (self.rotated_path, self.path):
+            try:
+                with open(path, mode="rb+") as f:
+                    good = 0
+                    for line in f:
+                        try:
+                            if not line.endswith(b"\n"):
+                                raise ValueError("unterminated line")
+                            entry = json.loads(line.decode("utf-8"))
+                        except ValueError:
+                            # Torn write from a crash, nothing after it
+                            # can have been acknowledged. It's cut off so
+                            # new entries don't get glued onto it.
+                            f.truncate(good)
+                            break
+                        _apply_entry(self.data, entry)
+                        self.entries += 1
+                        good += len(line)
+            except FileNotFoundError:
+                pass
+
+    def apply(self, op, path, value=None):
+        entry = {"op": op, "path": list(path)}
+        if op == "set":
+            entry["value"] = value
+        line = json.dumps(entry, separators=(',', ':')) + "\n"
+        _apply_entry(self.data, entry)
+        if self._handle is None:
+            self._handle = open(self.path, encoding='utf-8', mode="a")
+        self._handle.write(line)
+        self._handle.flush()
+        self.entries += 1
+        return len(line)
+
+    def rotate(self):
+        self.close()
+        if os.path.isfile(self.path):
+            if self.rotated:
+                # A previous compaction failed, keep both around
+                with open(self.path, encoding='utf-8', mode="r") as src, \
+                        open(self.rotated_path, encoding='utf-8',
+                             mode="a") as dst:
+                    dst.write(src.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+            self.rotated = True
+        self.entries = 0
+
+    def drop_rotated(self):
+        if self.rotated:
+            try:
+                os.remove(self.rotated_path)
+            except FileNotFoundError:
+                pass
+            self.rotated = False
+
+    def reset(self):
+        self.close()
+        for path in (self.path, self.rotated_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.rotated = False
+        self.entries = 0
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def _apply_entry(data, entry):
+    *parents, key = entry["path"]
+    node = data
+    for p in parents:
+        node = node.setdefault(p, {})
+    if entry["op"] == "set":
+        node[key] = entry["value"]
+    else:
+        node.pop(key, None)
+
+
 def get_value(filename, key):
     with open(filename, encoding='utf-8', mode="r") as f:
         data = json.load(f)
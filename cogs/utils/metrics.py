@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+
+from aiohttp import web
+
+# Seconds, covering everything from a dict lookup to a slow HTTP call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram():
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics():
+    """Counters, gauges and histograms rendered in the Prometheus text
+    format
+
+    Metrics are identified by name plus an optional label dict. Gauges
+    can also be callables, which are only evaluated when rendered."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self.collectors = []
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def add_collector(self, func):
+        """func is called before every render, to copy in values that
+        are cheaper to read on demand than to keep in sync"""
+        self.collectors.append(func)
+
+    def set_counter(self, name, value, **labels):
+        self.counters[(name, _labels(labels))] = value
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def render(self):
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception:
+                logging.getLogger("red").exception("Metrics collector "
+                                                   "failed")
+        lines = []
+        self._render_simple(lines, self.counters, "counter")
+        self._render_simple(lines, self.gauges, "gauge")
+        for name, series in _by_name(self.histograms):
+            self._header(lines, name, "histogram")
+            for labels, h in series:
+                cumulative = 0
+                for bound, count in zip(h.buckets + ("+Inf",), h.counts):
+                    cumulative += count
+                    le = labels + (("le", str(bound)),)
+                    lines.append("{}_bucket{} {}".format(
+                        name, _format_labels(le), cumulative))
+                lines.append("{}_sum{} {}".format(
+                    name, _format_labels(labels), h.sum))
+                lines.append("{}_count{} {}".format(
+                    name, _format_labels(labels), h.count))
+        return "\n".join(lines) + "\n"
+
+    def _render_simple(self, lines, metrics, kind):
+        for name, series in _by_name(metrics):
+            self._header(lines, name, kind)
+            for labels, value in series:
+                if callable(value):
+                    try:
+                        value = value()
+                    except Exception:
+                        continue
+                lines.append("{}{} {}".format(name, _format_labels(labels),
+                                              value))
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append("# HELP {} {}".format(name, self.help[name]))
+        lines.append("# TYPE {} {}".format(name, kind))
+
+
+class MetricsServer():
+    """Serves a Metrics registry over HTTP at /metrics"""
+
+    def __init__(self, metrics, loop, *, host="127.0.0.1", port=9090):
+        self.metrics = metrics
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger("red")
+        self._handler = None
+        self._server = None
+
+    async def start(self):
+        app = web.Application(loop=self.loop)
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._handler = app.make_handler()
+        try:
+            self._server = await self.loop.create_server(
+                self._handler, self.host, self.port)
+        except OSError as e:
+            self.logger.error("Could not start the metrics endpoint on "
+                              "{}:{}: {}".format(self.host, self.port, e))
+            return
+        self.logger.info("Metrics available at http://{}:{}/metrics"
+                         "".format(self.host, self.port))
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.metrics.render(),
+                            content_type="text/plain")
+
+
+async def watch_loop(metrics, loop, *, interval=1):
+    """Records event loop lag and the number of tasks every interval"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval, loop=loop)
+        lag = max(time.perf_counter() - start - interval, 0)
+        metrics.observe("red_event_loop_lag_seconds", lag)
+        metrics.set_gauge("red_event_loop_tasks",
+                          len(asyncio.Task.all_tasks(loop=loop)))
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v))
+                          for k, v in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"') \
+                     .replace("\n", "\\n")
+
+
+def _by_name(metrics):
+    names = {}
+    for (name, labels), value in sorted(metrics.items(),
+                                        key=lambda i: i[0]):
+        names.setdefault(name, []).append((labels, value))
+    return names.items()
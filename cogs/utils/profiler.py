@@ -0,0 +1,111 @@
+import asyncio
+import functools
+import io
+import logging
+import random
+import time
+from collections import deque
+
+
+class _Call():
+    __slots__ = ("name", "start", "timer", "snapshot")
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.timer = None
+        self.snapshot = None
+
+
+class Profiler():
+    """Samples how long named calls take
+
+    Only sample_rate of the calls are timed, so leaving it on costs
+    next to nothing. The last `window` timings of every name are kept
+    for percentiles. A sampled call that runs past slow_threshold gets
+    its task's stack captured at that moment, which is logged together
+    with its total time when it finishes."""
+
+    def __init__(self, loop, *, sample_rate=0.0, slow_threshold=1.0,
+                 window=500):
+        self.loop = loop
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.window = window
+        self.logger = logging.getLogger("red.profiler")
+        self.timings = {}
+        self.calls = {}
+        self.slow_calls = {}
+
+    def start(self, name):
+        """Starts timing a call, returns None if it isn't sampled"""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        call = _Call(name, time.perf_counter())
+        task = asyncio.Task.current_task(loop=self.loop)
+        if task is not None:
+            call.timer = self.loop.call_later(self.slow_threshold,
+                                              self._snapshot, call, task)
+        return call
+
+    def stop(self, call):
+        if call is None:
+            return
+        elapsed = time.perf_counter() - call.start
+        if call.timer is not None:
+            call.timer.cancel()
+        self.record(call.name, elapsed)
+        if elapsed >= self.slow_threshold:
+            self.slow_calls[call.name] = self.slow_calls.get(call.name, 0) + 1
+            self.logger.warning("Slow call {} took {:.3f}s{}".format(
+                call.name, elapsed,
+                "\n" + call.snapshot if call.snapshot else ""))
+
+    def record(self, name, elapsed):
+        timings = self.timings.get(name)
+        if timings is None:
+            timings = self.timings[name] = deque(maxlen=self.window)
+        timings.append(elapsed)
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def percentiles(self, name, points=(50, 95, 99)):
+        timings = sorted(self.timings.get(name, ()))
+        if not timings:
+            return [0] * len(points)
+        last = len(timings) - 1
+        return [timings[round(last * p / 100)] for p in points]
+
+    def top(self, count=10, *, point=95):
+        """Returns (name, calls, p50, p95, p99, slow calls) of the count
+        names with the highest percentile point"""
+        rows = []
+        for name in self.timings:
+            p50, p95, p99, worst = self.percentiles(name,
+                                                    (50, 95, 99, point))
+            rows.append((worst, (name, self.calls[name], p50, p95, p99,
+                                 self.slow_calls.get(name, 0))))
+        rows.sort(key=lambda r: r[0], reverse=True)
+        return [row for worst, row in rows[:count]]
+
+    def reset(self):
+        self.timings.clear()
+        self.calls.clear()
+        self.slow_calls.clear()
+
+    def wrap(self, name, func):
+        """Returns a coroutine function that profiles func under name"""
+        @functools.wraps(func)
+        async def profiled(*args, **kwargs):
+            call = self.start(name)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.stop(call)
+        return profiled
+
+    def _snapshot(self, call, task):
+        if task.done():
+            return
+        stack = io.StringIO()
+        task.print_stack(file=stack)
+        call.snapshot = stack.getvalue()
@@ -26,6 +26,7 @@ class Settings:
                         "PREFIXES": []}
                         }
         self._memory_only = False
+        self._role_cache = {}
 
         if not dataIO.is_valid_json(self.path):
             self.bot_settings = deepcopy(self.default_settings)
@@ -212,6 +213,7 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings()
         self.bot_settings["default"]["ADMIN_ROLE"] = value
+        self.invalidate_role_cache()
 
     @property
     def default_mod(self):
@@ -224,6 +226,7 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings_v1()
         self.bot_settings["default"]["MOD_ROLE"] = value
+        self.invalidate_role_cache()
 
     @property
     def default_submod(self):
@@ -236,6 +239,7 @@ class Settings:
         if "default" not in self.bot_settings:
             self.update_old_settings_v1()
         self.bot_settings["default"]["SUBMOD_ROLE"] = value
+        self.invalidate_role_cache()
 
     @property
     def default_musicmod(self):
@@ -265,6 +269,66 @@ class Settings:
         else:
             return None
 
+    @property
+    def flush_interval(self):
+        """Seconds between write-behind flushes of registered data files"""
+        return self.bot_settings.get("FLUSH_INTERVAL", 5)
+
+    @flush_interval.setter
+    def flush_interval(self, value):
+        self.bot_settings["FLUSH_INTERVAL"] = value
+
+    @property
+    def storage_backend(self):
+        """Storage used for data files, either json or sqlite"""
+        return self.bot_settings.get("STORAGE_BACKEND", "json")
+
+    @storage_backend.setter
+    def storage_backend(self, value):
+        assert value in ("json", "sqlite")
+        self.bot_settings["STORAGE_BACKEND"] = value
+
+    @property
+    def sqlite_prefixes(self):
+        """Data paths kept in SQLite when the sqlite backend is used"""
+        return self.bot_settings.get("SQLITE_PREFIXES",
+                                     ["data/economy/", "data/mod/",
+                                      "data/notifications/",
+                                      "data/streams/"])
+
+    @property
+    def metrics_port(self):
+        """Local port of the HTTP metrics endpoint, None to disable it"""
+        return self.bot_settings.get("METRICS_PORT")
+
+    @metrics_port.setter
+    def metrics_port(self, value):
+        self.bot_settings["METRICS_PORT"] = value
+
+    @property
+    def profile_sample_rate(self):
+        """Share of listener and command calls the profiler times"""
+        return self.bot_settings.get("PROFILE_SAMPLE_RATE", 0.0)
+
+    @profile_sample_rate.setter
+    def profile_sample_rate(self, value):
+        self.bot_settings["PROFILE_SAMPLE_RATE"] = value
+
+    @property
+    def profile_slow_threshold(self):
+        """Seconds after which a profiled call is logged as slow"""
+        return self.bot_settings.get("PROFILE_SLOW_THRESHOLD", 1.0)
+
+    @property
+    def stall_threshold(self):
+        """Seconds the event loop can be blocked before it's reported,
+        0 to disable the watchdog"""
+        return self.bot_settings.get("STALL_THRESHOLD", 1.0)
+
+    @property
+    def metrics_host(self):
+        return self.bot_settings.get("METRICS_HOST", "127.0.0.1")
+
     def get_server(self, server):
         if server is None:
             return self.bot_settings["default"].copy()
@@ -287,6 +351,7 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["ADMIN_ROLE"] = value
+        self.invalidate_role_cache(server)
         self.save_settings()
 
     def get_server_mod(self, server):
@@ -304,6 +369,7 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["MOD_ROLE"] = value
+        self.invalidate_role_cache(server)
         self.save_settings()
 
     def get_server_submod(self, server):
@@ -321,6 +387,7 @@ class Settings:
         if server.id not in self.bot_settings:
             self.add_server(server.id)
         self.bot_settings[server.id]["SUBMOD_ROLE"] = value
+        self.invalidate_role_cache(server)
         self.save_settings()
 
     def get_server_musicmod(self, server):
@@ -340,6 +407,39 @@ class Settings:
         self.bot_settings[server.id]["MUSICMOD_ROLE"] = value
         self.save_settings()
 
+    def get_server_role_ids(self, server, *, exact=False):
+        """Returns the IDs of the server's admin, mod and submod roles
+
+        The result is a dict of frozensets keyed by "ADMIN", "MOD",
+        "SUBMOD" and "ANY", the union of the three. Role names are
+        matched case insensitively, or exactly if exact is True, and
+        resolved once per server until invalidate_role_cache is called."""
+        if server is None:
+            return {"ADMIN": frozenset(), "MOD": frozenset(),
+                    "SUBMOD": frozenset(), "ANY": frozenset()}
+        cached = self._role_cache.get(server.id)
+        if cached is None:
+            names = {"ADMIN": self.get_server_admin(server),
+                     "MOD": self.get_server_mod(server),
+                     "SUBMOD": self.get_server_submod(server)}
+            cached = {}
+            for is_exact in (False, True):
+                fold = (lambda n: n) if is_exact else str.lower
+                ids = {k: frozenset(r.id for r in server.roles
+                                    if fold(r.name) == fold(name))
+                       for k, name in names.items()}
+                ids["ANY"] = ids["ADMIN"] | ids["MOD"] | ids["SUBMOD"]
+                cached[is_exact] = ids
+            self._role_cache[server.id] = cached
+        return cached[exact]
+
+    def invalidate_role_cache(self, server=None):
+        """Forgets resolved role IDs for server, or for every server"""
+        if server is None:
+            self._role_cache.clear()
+        else:
+            self._role_cache.pop(server.id, None)
+
     def get_server_prefixes(self, server):
         if server is None or server.id not in self.bot_settings:
             return self.prefixes
@@ -361,4 +461,5 @@ class Settings:
 
     def add_server(self, sid):
         self.bot_settings[sid] = self.bot_settings["default"].copy()
+        self._role_cache.pop(sid, None)
         self.save_settings()
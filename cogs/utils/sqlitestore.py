@@ -0,0 +1,230 @@
+import json
+import sqlite3
+
+# Joins the keys of rows holding nested entries
+SEP = "\x1f"
+
+
+class SQLiteStore():
+    """Keeps JSON data files as keyed rows in a single SQLite database
+
+    Every top level key of a file (or index, for files holding a list)
+    is its own row, so saving a file only rewrites the rows whose
+    content changed and single entries can be read or written through
+    the primary key index. Files with a row depth above 1 get a row per
+    entry that many levels down instead, keyed by the joined keys."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                          "file TEXT PRIMARY KEY, "
+                          "kind TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS rows ("
+                          "file TEXT NOT NULL, "
+                          "key TEXT NOT NULL, "
+                          "value TEXT NOT NULL, "
+                          "PRIMARY KEY (file, key)) WITHOUT ROWID")
+        # Serialized rows as last written, used to skip unchanged ones
+        self._rows = {}
+        self._depths = {}
+
+    def set_depth(self, filename, depth):
+        self._depths[filename] = depth
+
+    def has(self, filename):
+        cur = self.conn.execute("SELECT 1 FROM files WHERE file = ?",
+                                (filename,))
+        return cur.fetchone() is not None
+
+    def load(self, filename):
+        cur = self.conn.execute("SELECT kind FROM files WHERE file = ?",
+                                (filename,))
+        row = cur.fetchone()
+        if row is None:
+            raise FileNotFoundError(filename)
+        kind = row[0]
+        cur = self.conn.execute("SELECT key, value FROM rows "
+                                "WHERE file = ?", (filename,))
+        rows = dict(cur.fetchall())
+        self._rows[filename] = rows
+        if kind == "list":
+            keys = sorted(rows, key=int)
+            return [json.loads(rows[k]) for k in keys]
+        return _unflatten(rows.items())
+
+    def save(self, filename, data, keys=None):
+        """Writes data, touching only the rows that changed
+
+        If keys is given only the rows of those top level keys are
+        compared, the others are assumed unchanged.
+        Returns the size of the rows written."""
+        if isinstance(data, list):
+            kind = "list"
+            items = ((str(i), v) for i, v in enumerate(data))
+            keys = None
+        elif isinstance(data, dict):
+            kind = "dict"
+            items = data.items()
+        else:
+            raise TypeError("Only dicts and lists can be stored")
+        old = self._rows.get(filename)
+        if old is None:
+            old = self._rows[filename] = {}
+            if self.has(filename):
+                self.load(filename)
+                old = self._rows[filename]
+        depth = self._depths.get(filename, 1)
+        if keys is None:
+            new = {}
+            for k, v in items:
+                new.update(self._flatten(k, v, depth))
+            removed = [(filename, k) for k in old if k not in new]
+        else:
+            new = {}
+            for key in keys:
+                if key in data:
+                    new.update(self._flatten(key, data[key], depth))
+            removed = [(filename, k) for k in old if k not in new and
+                       k.split(SEP, 1)[0] in keys]
+        changed = [(filename, k, v) for k, v in new.items()
+                   if old.get(k) != v]
+        with self._transaction():
+            self.conn.execute("INSERT OR REPLACE INTO files (file, kind) "
+                              "VALUES (?, ?)", (filename, kind))
+            self.conn.executemany("INSERT OR REPLACE INTO rows "
+                                  "(file, key, value) VALUES (?, ?, ?)",
+                                  changed)
+            self.conn.executemany("DELETE FROM rows WHERE file = ? "
+                                  "AND key = ?", removed)
+        for _, k in removed:
+            del old[k]
+        for _, k, v in changed:
+            old[k] = v
+        return sum(len(row[2]) for row in changed)
+
+    def get(self, filename, path):
+        """Reads the entry at path, a list of keys, from the rows
+        holding it"""
+        path = [str(k) for k in path]
+        ancestor = self._ancestor(filename, path)
+        if ancestor is not None:
+            n, value = ancestor
+            for key in path[n:]:
+                value = value[key]
+            return value
+        prefix = SEP.join(path) + SEP
+        cur = self.conn.execute("SELECT key, value FROM rows WHERE "
+                                "file = ? AND key > ? AND key < ?",
+                                (filename, prefix, prefix[:-1] + "\x20"))
+        rows = [(k[len(prefix):], v) for k, v in cur.fetchall()]
+        if not rows:
+            raise KeyError(path[-1])
+        return _unflatten(rows)
+
+    def put(self, filename, path, value):
+        """Sets the entry at path, rewriting only the rows under it
+
+        Returns the size of the rows written."""
+        return self._replace(filename, [str(k) for k in path], value)
+
+    def delete(self, filename, path):
+        self._replace(filename, [str(k) for k in path], None, delete=True)
+        return 0
+
+    def close(self):
+        self.conn.close()
+
+    def _replace(self, filename, path, value, delete=False):
+        depth = self._depths.get(filename, 1)
+        ancestor = self._ancestor(filename, path[:-1])
+        if ancestor is None and len(path) > depth:
+            # Part of a row that doesn't exist yet
+            ancestor = (depth, {})
+            if delete:
+                return 0
+        if ancestor is not None:
+            # The row holding path is rewritten with the change applied,
+            # which also splits rows written with a smaller depth
+            n, node = ancestor
+            top = node
+            for key in path[n:-1]:
+                node = node.setdefault(key, {})
+            if delete:
+                node.pop(path[-1], None)
+            else:
+                node[path[-1]] = value
+            path, value, delete = path[:n], top, False
+        key = SEP.join(path)
+        rows = [] if delete else \
+            [(filename, k, v) for k, v in
+             self._flatten(key, value, depth - len(path) + 1)]
+        with self._transaction():
+            self.conn.execute("DELETE FROM rows WHERE file = ? AND "
+                              "(key = ? OR key > ? AND key < ?)",
+                              (filename, key, key + SEP, key + "\x20"))
+            self.conn.executemany("INSERT INTO rows (file, key, value) "
+                                  "VALUES (?, ?, ?)", rows)
+        cached = self._rows.get(filename)
+        if cached is not None:
+            for k in [k for k in cached
+                      if k == key or k.startswith(key + SEP)]:
+                del cached[k]
+            cached.update((k, v) for _, k, v in rows)
+        return sum(len(row[2]) for row in rows)
+
+    def _ancestor(self, filename, path):
+        """Returns (length, value) of the row holding path or one of its
+        parents, None if there's none"""
+        keys = [SEP.join(path[:n]) for n in range(1, len(path) + 1)]
+        if not keys:
+            return None
+        cur = self.conn.execute("SELECT key, value FROM rows WHERE file = ? "
+                                "AND key IN ({})".format(
+                                    ", ".join("?" * len(keys))),
+                                [filename] + keys)
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return row[0].count(SEP) + 1, json.loads(row[1])
+
+    def _flatten(self, key, value, depth):
+        """Yields the (key, serialized value) rows of an entry"""
+        if depth > 1 and isinstance(value, dict) and value:
+            for k, v in value.items():
+                yield from self._flatten(key + SEP + k, v, depth - 1)
+        else:
+            yield key, self._dumps(value)
+
+    def _dumps(self, value):
+        return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+
+class _Transaction():
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN")
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+
+
+def _unflatten(rows):
+    data = {}
+    for key, value in rows:
+        *parents, last = key.split(SEP)
+        node = data
+        for p in parents:
+            node = node.setdefault(p, {})
+        node[last] = json.loads(value)
+    return data
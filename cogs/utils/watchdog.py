@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+COGS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UTILS_DIR = os.path.join(COGS_DIR, "utils")
+
+
+class LoopWatchdog():
+    """Reports event loop stalls from a separate thread
+
+    The loop bumps a heartbeat every interval. When the heartbeat is
+    older than threshold, the loop is stuck running something: its
+    thread's stack and the current task are logged, and the stall is
+    counted against the cog the stack leads to."""
+
+    def __init__(self, loop, *, threshold=1.0, interval=0.1):
+        self.loop = loop
+        self.threshold = threshold
+        self.interval = interval
+        self.logger = logging.getLogger("red.watchdog")
+        self.stalls = Counter()
+        self._last_beat = None
+        self._thread_id = None
+        self._handle = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch,
+                                        name="loop-watchdog", daemon=True)
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self._beat)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _beat(self):
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        if not self._stopped.is_set():
+            self._handle = self.loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        stalled_since = None
+        while not self._stopped.wait(self.threshold / 4):
+            last_beat = self._last_beat
+            if last_beat is None:  # Loop not running yet
+                continue
+            if stalled_since is not None:
+                if last_beat > stalled_since:
+                    self.logger.warning("Event loop unblocked after {:.2f}s"
+                                        "".format(last_beat - stalled_since))
+                    stalled_since = None
+            elif time.monotonic() - last_beat > self.threshold:
+                stalled_since = last_beat
+                self._report(time.monotonic() - last_beat)
+
+    def _report(self, blocked_for):
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        del frame
+        cog = self.attribute(stack)
+        self.stalls[cog] += 1
+        try:
+            task = asyncio.Task.current_task(loop=self.loop)
+        except Exception:
+            task = None
+        self.logger.warning(
+            "Event loop blocked for over {:.2f}s in {}, running {!r}\n{}"
+            "".format(blocked_for, cog, task,
+                      "".join(traceback.format_list(stack))))
+
+    def attribute(self, stack):
+        """Returns the name of the cog responsible for a stack
+
+        That's the outermost cog module in it, as the helpers it called
+        into are the cog's doing. Stacks only going through cogs/utils
+        are put on the helper, and anything else on red."""
+        helper = None
+        for entry in stack:
+            filename = os.path.abspath(entry[0])
+            if not filename.startswith(COGS_DIR + os.sep):
+                continue
+            name = os.path.splitext(os.path.basename(filename))[0]
+            if filename.startswith(UTILS_DIR + os.sep):
+                helper = helper or name
+            else:
+                return name
+        return helper or "red"
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from aiohttp.helpers import FormData
+
+WEBHOOK_URL = "https://discordapp.com/api/webhooks/{0}/{1}"
+
+
+class WebhookError(Exception):
+    pass
+
+
+class WebhookDispatcher():
+    """Posts to Discord webhooks through one pooled, keep-alive session
+
+    Every webhook gets its own rate limit bucket. Requests to a webhook
+    that's currently limited wait for its reset instead of hitting a 429,
+    and a 429 that still happens is retried after retry_after."""
+
+    def __init__(self, loop, *, limit=100, max_retries=5):
+        self.loop = loop
+        self.max_retries = max_retries
+        self.logger = logging.getLogger("red")
+        conn = aiohttp.TCPConnector(verify_ssl=False, limit=limit, loop=loop)
+        self.session = aiohttp.ClientSession(connector=conn, loop=loop)
+        self._buckets = {}
+
+    def close(self):
+        self.session.close()
+
+    async def execute(self, webhook_id, webhook_token, payload, *,
+                      file=None, user_agent=None):
+        """Executes a webhook and returns the response body
+
+        file is an optional (filename, bytes) tuple, sent as multipart
+        together with the payload fields."""
+        url = WEBHOOK_URL.format(webhook_id, webhook_token)
+        headers = {}
+        if user_agent is not None:
+            headers["user-agent"] = user_agent
+        if file is None:
+            headers["content-type"] = "application/json"
+        bucket = self._bucket(webhook_id)
+
+        for attempt in range(self.max_retries + 1):
+            async with bucket["lock"]:
+                delay = bucket["reset_at"] - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay, loop=self.loop)
+                if file is None:
+                    data = json.dumps(payload)
+                else:
+                    data = FormData()
+                    data.add_field("file", file[1], filename=file[0])
+                    for k, v in payload.items():
+                        data.add_field(k, v)
+                async with self.session.post(url, data=data,
+                                             headers=headers) as r:
+                    body = await r.text()
+                    self._update_bucket(bucket, r.headers)
+                    status = r.status
+            if status != 429:
+                return body
+            try:
+                retry_after = json.loads(body)["retry_after"] / 1000
+            except (ValueError, KeyError, TypeError):
+                retry_after = 1
+            bucket["reset_at"] = max(bucket["reset_at"],
+                                     time.time() + retry_after)
+            self.logger.debug("Webhook {} rate limited, retrying in {}s"
+                              "".format(webhook_id, retry_after))
+        raise WebhookError("Webhook {} still rate limited after {} retries"
+                           "".format(webhook_id, self.max_retries))
+
+    async def execute_many(self, requests, *, concurrency=5,
+                           user_agent=None):
+        """Executes (webhook_id, webhook_token, payload) requests with at
+        most concurrency of them in flight
+
+        Returns the response bodies, or the raised exceptions, in order."""
+        semaphore = asyncio.Semaphore(concurrency, loop=self.loop)
+
+        async def run(webhook_id, webhook_token, payload):
+            async with semaphore:
+                return await self.execute(webhook_id, webhook_token,
+                                          payload, user_agent=user_agent)
+
+        return await asyncio.gather(*[run(*r) for r in requests],
+                                    loop=self.loop, return_exceptions=True)
+
+    def _bucket(self, webhook_id):
+        if webhook_id not in self._buckets:
+            self._buckets[webhook_id] = {"lock": asyncio.Lock(loop=self.loop),
+                                         "reset_at": 0}
+        return self._buckets[webhook_id]
+
+    def _update_bucket(self, bucket, headers):
+        if headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                bucket["reset_at"] = float(headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                pass
@@ -0,0 +1,33 @@
+import re
+
+
+def compile_filter(words):
+    """Compiles a list of lowercase words into a single regex
+
+    The words are merged into a trie first, so the pattern branches once
+    per distinct next character instead of trying every word at every
+    position of the message. search() on the lowercased message returns
+    the first filtered word found, or None."""
+    if not words:
+        return None
+    root = {}
+    for word in words:
+        node = root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = True
+    return re.compile(_trie_pattern(root))
+
+
+def _trie_pattern(node):
+    alternatives = [re.escape(char) + _trie_pattern(child)
+                    for char, child in sorted(node.items()) if char]
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1 and "" not in node:
+        return alternatives[0]
+    pattern = "(?:" + "|".join(alternatives) + ")"
+    if "" in node:
+        pattern += "?"
+    return pattern
+
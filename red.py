@@ -8,6 +8,8 @@ import logging.handlers
 import traceback
 import datetime
 import subprocess
+import time
+import re
 import raven
 from raven.conf import setup_logging
 from raven.handlers.logging import SentryHandler
@@ -31,8 +33,12 @@ except AssertionError:
 
 from cogs.utils.settings import Settings
 from cogs.utils.dataIO import dataIO
+from cogs.utils.webhooks import WebhookDispatcher
+from cogs.utils.metrics import Metrics, MetricsServer, watch_loop
+from cogs.utils.profiler import Profiler
+from cogs.utils.watchdog import LoopWatchdog
 from cogs.utils.chat_formatting import inline
-from collections import Counter
+from collections import Counter, defaultdict
 from io import TextIOWrapper
 
 #
@@ -50,6 +56,121 @@ from io import TextIOWrapper
 
 description = "Robyul"
 
+URL_REGEX = re.compile(r"<?https?://[^\s]+>?")
+
+
+class ParsedMessage:
+    """Facts about a message computed once and shared by every message
+    listener
+
+    The more expensive ones (prefix, lowercased content, urls) are only
+    computed the first time they're asked for."""
+
+    __slots__ = ("bot", "message", "server", "channel", "author",
+                 "is_private", "is_own", "is_bot", "_prefix", "_lower",
+                 "_urls")
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.server = message.server
+        self.channel = message.channel
+        self.author = message.author
+        self.is_private = message.channel.is_private
+        self.is_own = message.author.id == bot.user.id
+        self.is_bot = message.author.bot
+        self._prefix = False
+        self._lower = None
+        self._urls = None
+
+    @property
+    def prefix(self):
+        """The command prefix the message starts with, or None"""
+        if self._prefix is False:
+            self._prefix = None
+            content = self.message.content
+            for p in self.bot.settings.get_prefixes(self.server):
+                if content.startswith(p):
+                    self._prefix = p
+                    break
+        return self._prefix
+
+    @property
+    def is_command(self):
+        return self.prefix is not None
+
+    @property
+    def lower(self):
+        if self._lower is None:
+            self._lower = self.message.content.lower()
+        return self._lower
+
+    @property
+    def urls(self):
+        """Attachment urls followed by the links in the content, except
+        the ones suppressed with <>"""
+        if self._urls is None:
+            urls = [a["url"] for a in self.message.attachments]
+            content = self.message.content
+            if "http" in content:
+                for link in URL_REGEX.findall(content):
+                    if link[0] == "<" and link[-1] == ">":
+                        continue
+                    urls.append(link.lstrip("<"))
+            self._urls = urls
+        return self._urls
+
+
+class MessageView(discord.Message):
+    """A message with different content that shares everything else
+    with the original instead of copying it
+
+    Anything not set on the view itself is looked up on the original,
+    so it still passes as a discord.Message for commands and checks."""
+
+    def __init__(self, message, content):
+        self._original = message
+        self.content = content
+
+    def __getattr__(self, name):
+        if name == "_original":
+            raise AttributeError(name)
+        return getattr(self._original, name)
+
+
+class MessageListener:
+    __slots__ = ("func", "private", "own", "bots", "commands", "servers",
+                 "channels")
+
+    def __init__(self, func, *, private, own, bots, commands, servers,
+                 channels):
+        self.func = func
+        self.private = private
+        self.own = own
+        self.bots = bots
+        self.commands = commands
+        self.servers = None if servers is None else set(servers)
+        self.channels = None if channels is None else set(channels)
+
+    def accepts(self, parsed):
+        if parsed.is_private and not self.private:
+            return False
+        if parsed.is_own:
+            if not self.own:
+                return False
+        elif parsed.is_bot and not self.bots:
+            return False
+        if self.servers is not None and \
+                (parsed.server is None or parsed.server.id not in self.servers):
+            return False
+        if self.channels is not None and \
+                parsed.channel.id not in self.channels:
+            return False
+        if self.commands is not None and \
+                parsed.is_command is not self.commands:
+            return False
+        return True
+
 
 class Bot(commands.Bot):
     def __init__(self, *args, **kwargs):
@@ -68,6 +189,10 @@ class Bot(commands.Bot):
         self.counter = Counter()
         self.uptime = datetime.datetime.utcnow()  # Refreshed before login
         self._message_modifiers = []
+        self._message_listeners = []
+        self._unrouted_listeners = []
+        self._channel_routes = {}
+        self._server_routes = {}
         self.settings = Settings()
         self._intro_displayed = False
         self._shutdown_mode = None
@@ -80,6 +205,106 @@ class Bot(commands.Bot):
             if self.settings.self_bot:
                 kwargs['pm_help'] = False
         super().__init__(*args, command_prefix=prefix_manager, **kwargs)
+        if self.settings.storage_backend == "sqlite":
+            dataIO.use_sqlite("data/red/storage.db",
+                              self.settings.sqlite_prefixes)
+        dataIO.start_flusher(self.loop, self.settings.flush_interval)
+        self.webhooks = WebhookDispatcher(self.loop)
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self._command_starts = {}
+        self._setup_metrics()
+        self.profiler = Profiler(
+            self.loop, sample_rate=self.settings.profile_sample_rate,
+            slow_threshold=self.settings.profile_slow_threshold)
+        self._profiled_listeners = {}
+        self.watchdog = None
+        if self.settings.stall_threshold:
+            # Started on the first on_ready, setup and cog loading
+            # block the loop on purpose
+            self.watchdog = LoopWatchdog(
+                self.loop, threshold=self.settings.stall_threshold)
+
+    def _setup_metrics(self):
+        metrics = self.metrics
+        metrics.describe("red_events_total",
+                         "Messages read, commands processed, resumes")
+        metrics.describe("red_listener_seconds",
+                         "Time spent in each message listener")
+        metrics.describe("red_command_seconds",
+                         "Time from invoking a command to it finishing")
+        metrics.describe("red_event_loop_lag_seconds",
+                         "How late a 1s sleep on the event loop wakes up")
+        metrics.describe("red_loop_stalls_total",
+                         "Event loop stalls over the threshold, per cog")
+        metrics.describe("red_dataio_writes_total",
+                         "Data file writes per storage kind")
+        metrics.describe("red_dataio_written_bytes_total",
+                         "Data file bytes written per storage kind")
+
+        def collect(metrics):
+            for event, count in self.counter.items():
+                metrics.set_counter("red_events_total", count, event=event)
+            for kind, count in dataIO.writes.items():
+                metrics.set_counter("red_dataio_writes_total", count,
+                                    kind=kind)
+            for kind, size in dataIO.bytes_written.items():
+                metrics.set_counter("red_dataio_written_bytes_total", size,
+                                    kind=kind)
+            metrics.set_gauge("red_servers", len(self.servers))
+            if self.watchdog is not None:
+                for cog, count in self.watchdog.stalls.items():
+                    metrics.set_counter("red_loop_stalls_total", count,
+                                        cog=cog)
+
+        metrics.add_collector(collect)
+        if self.settings.metrics_port:
+            self.metrics_server = MetricsServer(
+                metrics, self.loop, host=self.settings.metrics_host,
+                port=self.settings.metrics_port)
+            self.loop.create_task(self.metrics_server.start())
+            self.loop.create_task(watch_loop(metrics, self.loop))
+
+    def dispatch(self, event, *args, **kwargs):
+        # Commands are invoked right after "command" is dispatched and
+        # "command_completion" / "command_error" right after they end
+        if event == "command":
+            command, ctx = args
+            call = self.profiler.start("command " + command.qualified_name)
+            self._command_starts[ctx] = (time.perf_counter(), call)
+        elif event in ("command_completion", "command_error"):
+            ctx = args[1]
+            started = self._command_starts.pop(ctx, None)
+            if started is not None:
+                start, call = started
+                self.profiler.stop(call)
+                self.metrics.observe("red_command_seconds",
+                                     time.perf_counter() - start,
+                                     command=ctx.command.qualified_name)
+        super().dispatch(event, *args, **kwargs)
+
+    def add_listener(self, func, name=None):
+        # Profiled under the listener's name, the wrapper keeps
+        # func's __module__ so unloading its extension still removes it.
+        # Listeners added while profiling is off are left alone.
+        name = func.__name__ if name is None else name
+        if self.profiler.sample_rate and asyncio.iscoroutinefunction(func):
+            wrapper = self.profiler.wrap(func.__qualname__, func)
+            self._profiled_listeners[(func, name)] = wrapper
+            func = wrapper
+        super().add_listener(func, name)
+
+    def remove_listener(self, func, name=None):
+        name = func.__name__ if name is None else name
+        func = self._profiled_listeners.pop((func, name), func)
+        super().remove_listener(func, name)
+
+    async def process_commands(self, message):
+        call = self.profiler.start("process_commands")
+        try:
+            await super().process_commands(message)
+        finally:
+            self.profiler.stop(call)
 
     async def send_message(self, *args, **kwargs):
         if self._message_modifiers:
@@ -107,6 +332,7 @@ class Bot(commands.Bot):
         If restart is True, the exit code will be 26 instead
         The launcher automatically restarts Red when that happens"""
         self._shutdown_mode = not restart
+        dataIO.stop_flusher()
         await self.logout()
 
     def add_message_modifier(self, func):
@@ -140,6 +366,113 @@ class Bot(commands.Bot):
         """Removes all message modifiers from the bot"""
         self._message_modifiers.clear()
 
+    def add_message_listener(self, func, *, private=False, own=False,
+                             bots=True, commands=None, servers=None,
+                             channels=None):
+        """
+        Subscribes a coroutine to incoming messages
+
+        func is called with a ParsedMessage, only for the messages
+        that pass the filters:
+        private: also DMs
+        own: also the bot's own messages
+        bots: also messages from other bots
+        commands: None for every message, True for commands only,
+        False for non-commands only
+        servers / channels: only messages from these IDs (None for all)
+
+        Listeners with channels or servers are routed: messages from
+        anywhere else never even look at them.
+
+        Listeners are removed when the extension defining func is
+        unloaded.
+        """
+        if not asyncio.iscoroutinefunction(func):
+            raise TypeError("Message listeners must be coroutines.")
+
+        self._message_listeners.append(MessageListener(
+            func, private=private, own=own, bots=bots, commands=commands,
+            servers=servers, channels=channels))
+        self._build_message_routes()
+
+    def remove_message_listener(self, func):
+        """Removes a message listener from the bot"""
+        self._message_listeners = [l for l in self._message_listeners
+                                   if l.func != func]
+        self._build_message_routes()
+
+    def route_message_listener(self, func, *, servers=None, channels=None):
+        """Changes the servers / channels a message listener watches
+
+        Meant to be called whenever the cog's configuration of what it
+        watches changes. None means everywhere."""
+        for listener in self._message_listeners:
+            if listener.func == func:
+                listener.servers = None if servers is None else set(servers)
+                listener.channels = None if channels is None else \
+                    set(channels)
+        self._build_message_routes()
+
+    def _build_message_routes(self):
+        unrouted = []
+        channel_routes = defaultdict(list)
+        server_routes = defaultdict(list)
+        for listener in self._message_listeners:
+            if listener.channels is not None:
+                for channel_id in listener.channels:
+                    channel_routes[channel_id].append(listener)
+            elif listener.servers is not None:
+                for server_id in listener.servers:
+                    server_routes[server_id].append(listener)
+            else:
+                unrouted.append(listener)
+        self._unrouted_listeners = unrouted
+        self._channel_routes = dict(channel_routes)
+        self._server_routes = dict(server_routes)
+
+    def dispatch_message(self, message):
+        """Parses message once and schedules the listeners wanting it"""
+        parsed = ParsedMessage(self, message)
+        listeners = self._unrouted_listeners
+        routed = self._channel_routes.get(message.channel.id)
+        if routed:
+            listeners = listeners + routed
+        if message.server is not None:
+            routed = self._server_routes.get(message.server.id)
+            if routed:
+                listeners = listeners + routed
+        for listener in listeners:
+            if listener.accepts(parsed):
+                self.loop.create_task(
+                    self._run_message_listener(listener.func, parsed))
+        return parsed
+
+    async def _run_message_listener(self, func, parsed):
+        start = time.perf_counter()
+        call = self.profiler.start(func.__qualname__)
+        try:
+            await func(parsed)
+        except Exception:
+            self.logger.exception("Exception in message listener {}"
+                                  "".format(func.__qualname__))
+        finally:
+            self.profiler.stop(call)
+            self.metrics.observe("red_listener_seconds",
+                                 time.perf_counter() - start,
+                                 listener=func.__qualname__)
+
+    def unload_extension(self, name):
+        self._message_listeners = [
+            l for l in self._message_listeners
+            if not (l.func.__module__ == name or
+                    l.func.__module__.startswith(name + "."))]
+        self._build_message_routes()
+        for key in list(self._profiled_listeners):
+            module = key[0].__module__
+            if module == name or module.startswith(name + "."):
+                del self._profiled_listeners[key]
+        super().unload_extension(name)
+
     async def send_cmd_help(self, ctx):
         if ctx.invoked_subcommand:
             pages = self.formatter.format_help_for(ctx, ctx.invoked_subcommand)
@@ -165,16 +498,10 @@ class Bot(commands.Bot):
             if self.settings.owner == author.id:
                 return True
             if not message.channel.is_private:
-                server = message.server
-                names = (self.settings.get_server_admin(
-                    server), self.settings.get_server_mod(server),
-                self.settings.get_server_submod(server))
-                results = map(
-                    lambda name: discord.utils.get(author.roles, name=name),
-                    names)
-                for r in results:
-                    if r is not None:
-                        return True
+                role_ids = self.settings.get_server_role_ids(message.server,
+                                                             exact=True)
+                if not role_ids["ANY"].isdisjoint(r.id for r in author.roles):
+                    return True
 
             if author.id in mod.blacklist_list:
                 return False
@@ -258,6 +585,7 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
     __main__.send_cmd_help = bot.send_cmd_help  # Backwards
     __main__.user_allowed = bot.user_allowed    # compatibility
     __main__.settings = bot.settings            # sucks
+    __main__.MessageView = MessageView
 
     async def get_oauth_url():
         try:
@@ -301,6 +629,8 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
         if bot._intro_displayed:
             return
         bot._intro_displayed = True
+        if bot.watchdog is not None:
+            bot.watchdog.start()
 
         owner_cog = bot.get_cog('Owner')
         total_cogs = len(owner_cog._list_cogs())
@@ -345,6 +675,18 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
 
         await bot.get_cog('Owner').disable_commands()
 
+    async def invalidate_role_cache(*args):
+        bot.settings.invalidate_role_cache(args[-1].server)
+
+    bot.add_listener(invalidate_role_cache, "on_server_role_create")
+    bot.add_listener(invalidate_role_cache, "on_server_role_delete")
+    bot.add_listener(invalidate_role_cache, "on_server_role_update")
+
+    async def forget_server_roles(server):
+        bot.settings.invalidate_role_cache(server)
+
+    bot.add_listener(forget_server_roles, "on_server_remove")
+
     @bot.event
     async def on_resumed():
         bot.counter["session_resumed"] += 1
@@ -356,6 +698,7 @@ def initialize(bot_class=Bot, formatter_class=Formatter):
     @bot.event
     async def on_message(message):
         bot.counter["messages_read"] += 1
+        bot.dispatch_message(message)
         if bot.user_allowed(message):
             await bot.process_commands(message)
 
@@ -677,6 +1020,12 @@ if __name__ == '__main__':
                              exc_info=e)
         loop.run_until_complete(bot.logout())
     finally:
+        dataIO.stop_flusher()
+        bot.webhooks.close()
+        if bot.metrics_server is not None:
+            bot.metrics_server.close()
+        if bot.watchdog is not None:
+            bot.watchdog.stop()
         loop.close()
         if bot._shutdown_mode is True:
             exit(0)
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from cogs.utils.dataIO import DataIO
+
+
+class JournalReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, "data.json")
+        self.journal = os.path.join(self.folder, "data.journal")
+        with open(self.filename, "w") as f:
+            json.dump({}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def load(self):
+        dataIO = DataIO()
+        return dataIO, dataIO.load_journaled(self.filename)
+
+    def test_entry_after_torn_tail_survives_reload(self):
+        dataIO, data = self.load()
+        dataIO.journal_set(self.filename, ["s", "1"], {"x": 1})
+        dataIO._journals[self.filename].close()
+        # Crash halfway through writing the next entry
+        with open(self.journal, "a") as f:
+            f.write('{"op":"set","path":["s","2"],"value":{"x":"val')
+
+        dataIO, data = self.load()
+        self.assertEqual(data, {"s": {"1": {"x": 1}}})
+        dataIO.journal_set(self.filename, ["s", "3"], {"x": 3})
+        dataIO._journals[self.filename].close()
+
+        dataIO, data = self.load()
+        self.assertEqual(data, {"s": {"1": {"x": 1}, "3": {"x": 3}}})
+
+    def test_unterminated_last_line_is_dropped(self):
+        with open(self.journal, "w") as f:
+            f.write('{"op":"set","path":["a"],"value":1}\n'
+                    '{"op":"set","path":["b"],"value":2}')
+        dataIO, data = self.load()
+        self.assertEqual(data, {"a": 1})
+        dataIO.journal_set(self.filename, ["c"], 3)
+        dataIO._journals[self.filename].close()
+
+        dataIO, data = self.load()
+        self.assertEqual(data, {"a": 1, "c": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()